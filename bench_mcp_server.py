@@ -0,0 +1,361 @@
+"""Benchmark y generador de carga para local_mcp_server.
+
+Ejemplos:
+  python bench_mcp_server.py --scale small --mode inproc
+  python bench_mcp_server.py --sales-rows 1000000 --inventory-rows 50000 --docs 2000 --mode both -o bench.json
+  python bench_mcp_server.py --scale medium --compare bench_base.json
+
+Genera datos sintéticos (sales.csv, inventory.csv, docs/*.txt) en un directorio temporal, ejecuta cada
+tool de TOOLS con el test client de Flask (inproc) y/o contra un gunicorn real con clientes aiohttp
+concurrentes (gunicorn) y guarda p50/p95/p99, throughput y RSS pico por tool en JSON.
+Cada modo se mide en frío (sin caché de resultados ni de contexto: cada llamada calcula) y en caliente
+(con cachés, argumentos repetidos); los resultados en caliente van en "<modo>_warm".
+"""
+import argparse, asyncio, base64, contextlib, json, os, pathlib, platform, resource, shutil, socket, subprocess, sys, tempfile, time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+BASE_DIR = pathlib.Path(__file__).parent.resolve()
+
+SCALES = {
+    "small":  {"sales_rows": 1_000,      "inventory_rows": 200,     "docs": 10},
+    "medium": {"sales_rows": 100_000,    "inventory_rows": 10_000,  "docs": 500},
+    "large":  {"sales_rows": 1_000_000,  "inventory_rows": 100_000, "docs": 5_000},
+    "xl":     {"sales_rows": 10_000_000, "inventory_rows": 200_000, "docs": 100_000},
+}
+MONTHS = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+WORDS = ("inventario seguridad calidad monitores política devoluciones garantía proveedor lead time días stock "
+         "mínimo reabastecimiento almacén ventas ingreso producto laptop mouse teclado precio descuento "
+         "cliente pedido envío factura auditoría procedimiento manual línea bodega reposición").split()
+
+# argumentos por tool; las que escriben van al final para no alterar las mediciones de lectura
+TOOL_ARGS: Dict[str, Dict[str, Any]] = {
+    "sales.summary": {"month": "Agosto"},
+    "sales.top": {"n": 5, "by": "revenue"},
+    "sales.timeseries": {"start": "2024-03", "end": "2024-08", "freq": "W", "window": 4},
+    "inventory.status": {"only_critical": True, "limit": 100},
+    "inventory.reorder_suggestions": {"lead_time_days": 7, "top_k": 50},
+    "docs.search": {"q": "inventario de seguridad"},
+    "llm.ask": {"query": "¿Qué productos necesitan reabastecimiento según la política de calidad?"},
+    "report.generate": {"type": "inventario", "format": "csv", "wait": True, "timeout": 300},
+    # reescribe siempre el mismo documento: el corpus no crece entre iteraciones
+    "docs.ingest": {"docs": [{"name": "bench_ingest", "text": "Procedimiento de reposición de bodega: "
+                                                             "revisar stock mínimo y lead time del proveedor."}]},
+}
+WRITE_TOOLS = ("docs.ingest", "admin.ingest_csv")
+# corrida en frío: las cachés de resultados sirven todo tras la primera llamada con los mismos argumentos
+COLD_ENV = {"RESULT_CACHE_ENTRIES": "0", "LLM_CONTEXT_CACHE": "0"}
+
+
+def generate_dataset(out: pathlib.Path, sales_rows: int, inventory_rows: int, docs: int, seed: int = 42,
+                     chunk: int = 1_000_000) -> None:
+    rng = np.random.default_rng(seed)
+    out.mkdir(parents=True, exist_ok=True)
+    products = np.array([f"Producto {i:06d}" for i in range(inventory_rows)])
+    with open(out / "sales.csv", "w", encoding="utf-8", newline="") as fh:
+        for i in range(0, sales_rows, chunk):
+            n = min(chunk, sales_rows - i)
+            dates = np.datetime64("2024-01-01") + rng.integers(0, 366, n).astype("timedelta64[D]")
+            pd.DataFrame({
+                "date": dates,
+                "month": np.array(MONTHS)[dates.astype("datetime64[M]").astype(int) % 12],
+                "product": products[rng.integers(0, inventory_rows, n)],
+                "units": rng.integers(1, 200, n),
+                "unit_price": np.round(rng.uniform(1, 2000, n), 2),
+            }).to_csv(fh, index=False, header=(i == 0))
+    pd.DataFrame({
+        "product": products,
+        "stock": rng.integers(0, 500, inventory_rows),
+        "min_required": rng.integers(0, 300, inventory_rows),
+    }).to_csv(out / "inventory.csv", index=False, encoding="utf-8")
+    docs_dir = out / "docs"
+    docs_dir.mkdir(exist_ok=True)
+    words = np.array(WORDS)
+    for i in range(docs):
+        body = " ".join(words[rng.integers(0, len(words), int(rng.integers(80, 600)))])
+        (docs_dir / f"doc_{i:06d}.txt").write_text(body.capitalize() + ".", encoding="utf-8")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples: return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    arr = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3), "mean_ms": round(float(arr.mean()), 3)}
+
+
+def _reset_peak_rss() -> None:
+    # Linux: escribir 5 en clear_refs reinicia VmHWM (pico de RSS) del proceso
+    try:
+        with open("/proc/self/clear_refs", "w") as fh: fh.write("5")
+    except OSError:
+        pass
+
+def _peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"): return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
+
+
+def ingest_args(data_dir: pathlib.Path) -> Dict[str, Any]:
+    # upsert de una fila existente: idempotente, no cambia el tamaño del dataset entre iteraciones
+    first = pd.read_csv(data_dir / "inventory.csv", nrows=1)
+    return {"kind": "inventory", "mode": "upsert",
+            "csv_base64": base64.b64encode(first.to_csv(index=False).encode("utf-8")).decode("ascii")}
+
+
+@contextlib.contextmanager
+def result_caches_off(srv):
+    caches = (srv.RESULT_CACHE, srv.CONTEXT_CACHE)
+    saved = [c.max_entries for c in caches]
+    for c in caches:
+        c.max_entries = 0
+        c.clear()
+    try:
+        yield
+    finally:
+        for c, n in zip(caches, saved): c.max_entries = n
+
+def bench_inproc(data_dir: pathlib.Path, files_dir: pathlib.Path, iterations: int, warmup: int,
+                 cold: bool = True) -> Dict[str, Any]:
+    os.environ["MCP_DATA_DIR"], os.environ["MCP_FILES_DIR"] = str(data_dir), str(files_dir)
+    if str(BASE_DIR) not in sys.path: sys.path.insert(0, str(BASE_DIR))
+    t0 = time.perf_counter()
+    import local_mcp_server as srv
+    startup = time.perf_counter() - t0
+    with result_caches_off(srv) if cold else contextlib.nullcontext():
+        return _bench_inproc(srv, data_dir, iterations, warmup, "inproc" if cold else "inproc_warm",
+                             {"_startup_s": round(startup, 3), "_cache": "off" if cold else "on"})
+
+def _bench_inproc(srv, data_dir: pathlib.Path, iterations: int, warmup: int, label: str,
+                  results: Dict[str, Any]) -> Dict[str, Any]:
+    client = srv.app.test_client()
+    args_for = dict(TOOL_ARGS, **{"admin.ingest_csv": ingest_args(data_dir)})
+    for name in ordered_tools(srv.TOOLS):
+        args = tool_args(name, args_for, lambda n, a: client.post("/mcp/tools/call", json={"name": n, "arguments": a}).get_json())
+        _reset_peak_rss()
+        samples, errors = [], 0
+        for i in range(warmup + iterations):
+            t = time.perf_counter()
+            r = client.post("/mcp/tools/call", json={"id": i, "name": name, "arguments": args})
+            dt = time.perf_counter() - t
+            body = r.get_json(silent=True) or {}
+            if r.status_code >= 400 or "error" in body or body.get("result", {}).get("isError"): errors += 1
+            if i >= warmup: samples.append(dt)
+        total = sum(samples)
+        results[name] = dict(percentiles(samples), n=len(samples), errors=errors,
+                             throughput_rps=round(len(samples) / total, 2) if total else None,
+                             peak_rss_mb=_peak_rss_mb())
+        print(f"[{label}] {name:32s} p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms", flush=True)
+    return results
+
+
+def ordered_tools(tools: Dict[str, Any]) -> List[str]:
+    return [n for n in tools if n not in WRITE_TOOLS] + [n for n in tools if n in WRITE_TOOLS]
+
+def tool_args(name: str, args_for: Dict[str, Dict[str, Any]], call) -> Dict[str, Any]:
+    if name == "report.status":
+        # se necesita un job existente
+        job = call("report.generate", {"type": "inventario", "format": "csv"})
+        return {"job_id": job["result"]["structuredContent"]["job_id"]}
+    return args_for.get(name, {})
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _children(pid: int) -> List[int]:
+    out = []
+    for p in pathlib.Path("/proc").iterdir():
+        if not p.name.isdigit(): continue
+        try:
+            if int((p / "stat").read_text().rsplit(")", 1)[1].split()[1]) == pid: out.append(int(p.name))
+        except (OSError, IndexError, ValueError):
+            pass
+    return out
+
+def _server_peak_rss(pid: int) -> Optional[float]:
+    vals = [v for v in (_peak_rss_mb(p) for p in [pid] + _children(pid)) if v is not None]
+    return round(sum(vals), 1) if vals else None
+
+
+async def _drive(base: str, name: str, args: Dict[str, Any], requests: int, concurrency: int) -> Tuple[List[float], int, float]:
+    import aiohttp
+    samples: List[float] = []
+    errors = 0
+    queue = iter(range(requests))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as session:
+        async def worker():
+            nonlocal errors
+            for i in queue:
+                t = time.perf_counter()
+                try:
+                    async with session.post(f"{base}/mcp/tools/call", json={"id": i, "name": name, "arguments": args}) as r:
+                        body = await r.json(content_type=None)
+                        if r.status >= 400 or "error" in body or body.get("result", {}).get("isError"): errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                samples.append(time.perf_counter() - t)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, errors, time.perf_counter() - t0
+
+
+def bench_gunicorn(data_dir: pathlib.Path, files_dir: pathlib.Path, requests: int, concurrency: int,
+                   workers: int, threads: int, cold: bool = True) -> Dict[str, Any]:
+    import aiohttp
+    if not shutil.which("gunicorn"):
+        print("[gunicorn] gunicorn no está instalado; se omite", file=sys.stderr)
+        return {"_skipped": "gunicorn no instalado"}
+    port = _free_port()
+    env = dict(os.environ, MCP_DATA_DIR=str(data_dir), MCP_FILES_DIR=str(files_dir), **(COLD_ENV if cold else {}))
+    label = "gunicorn" if cold else "gunicorn_warm"
+    cmd = ["gunicorn", "-w", str(workers), "-k", "gthread", "--threads", str(threads), "-b", f"127.0.0.1:{port}",
+           "--timeout", "600", "local_mcp_server:app"]
+    # stderr a un archivo: un PIPE que nadie lee se llena con el log de acceso/errores y bloquea a gunicorn
+    log_path = data_dir.parent / f"{label}.log"
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    base = f"http://127.0.0.1:{port}"
+    results: Dict[str, Any] = {"_config": {"workers": workers, "threads": threads, "concurrency": concurrency,
+                                           "cache": "off" if cold else "on"}}
+    try:
+        async def wait_ready():
+            async with aiohttp.ClientSession() as s:
+                for _ in range(600):
+                    try:
+                        async with s.get(f"{base}/health") as r:
+                            if r.status == 200: return
+                    except aiohttp.ClientError:
+                        pass
+                    if proc.poll() is not None:
+                        raise RuntimeError(log_path.read_bytes()[-4000:].decode(errors="replace"))
+                    await asyncio.sleep(0.5)
+            raise RuntimeError("gunicorn no respondió a /health")
+        async def call(n, a):
+            async with aiohttp.ClientSession() as s:
+                async with s.post(f"{base}/mcp/tools/call", json={"name": n, "arguments": a}) as r:
+                    return await r.json(content_type=None)
+        asyncio.run(wait_ready())
+        args_for = dict(TOOL_ARGS, **{"admin.ingest_csv": ingest_args(data_dir)})
+        tools = asyncio.run(_list_tools(base))
+        for name in ordered_tools(dict.fromkeys(tools)):
+            args = tool_args(name, args_for, lambda n, a: asyncio.run(call(n, a)))
+            samples, errors, wall = asyncio.run(_drive(base, name, args, requests, concurrency))
+            results[name] = dict(percentiles(samples), n=len(samples), errors=errors,
+                                 throughput_rps=round(len(samples) / wall, 2) if wall else None,
+                                 peak_rss_mb=_server_peak_rss(proc.pid))
+            print(f"[{label}] {name:32s} p50={results[name]['p50_ms']}ms p95={results[name]['p95_ms']}ms "
+                  f"rps={results[name]['throughput_rps']}", flush=True)
+    finally:
+        proc.terminate()
+        try: proc.wait(10)
+        except subprocess.TimeoutExpired: proc.kill()
+        log.close()
+    return results
+
+async def _list_tools(base: str) -> List[str]:
+    import aiohttp
+    async with aiohttp.ClientSession() as s:
+        async with s.get(f"{base}/mcp/tools/list") as r:
+            return [t["name"] for t in (await r.json())["tools"]]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> int:
+    # compara p95 por modo/tool; devuelve la cantidad de regresiones por encima del umbral
+    regressions = 0
+    for mode, tools in current["results"].items():
+        base_tools = baseline.get("results", {}).get(mode, {})
+        for name, cur in tools.items():
+            if name.startswith("_") or name not in base_tools: continue
+            old, new = base_tools[name].get("p95_ms"), cur.get("p95_ms")
+            if not old or new is None: continue
+            delta = (new - old) / old
+            flag = "REGRESIÓN" if delta > threshold else ""
+            regressions += bool(flag)
+            print(f"{mode:9s} {name:32s} p95 {old:>10.3f} -> {new:>10.3f} ms ({delta:+.1%}) {flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", choices=sorted(SCALES), default="small")
+    ap.add_argument("--sales-rows", type=int)
+    ap.add_argument("--inventory-rows", type=int)
+    ap.add_argument("--docs", type=int)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--mode", choices=["inproc", "gunicorn", "both"], default="inproc")
+    ap.add_argument("--cache", choices=["cold", "warm", "both"], default="both",
+                    help="cold: sin cachés de resultados; warm: con cachés (resultados en '<modo>_warm')")
+    ap.add_argument("--iterations", type=int, default=50, help="llamadas medidas por tool (inproc)")
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--requests", type=int, default=200, help="llamadas por tool (gunicorn)")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--data-dir", type=pathlib.Path, help="reutilizar/generar datos aquí en vez de un temporal")
+    ap.add_argument("-o", "--output", type=pathlib.Path, default=pathlib.Path("bench_results.json"))
+    ap.add_argument("--compare", type=pathlib.Path, help="JSON de una corrida anterior para comparar p95")
+    ap.add_argument("--threshold", type=float, default=0.10, help="regresión tolerada en p95 (0.10 = 10%%)")
+    opts = ap.parse_args(argv)
+
+    scale = dict(SCALES[opts.scale])
+    for k in ("sales_rows", "inventory_rows", "docs"):
+        if getattr(opts, k) is not None: scale[k] = getattr(opts, k)
+
+    tmp = None
+    if opts.data_dir:
+        data_dir = opts.data_dir
+    else:
+        tmp = tempfile.mkdtemp(prefix="mcp_bench_")
+        data_dir = pathlib.Path(tmp) / "data"
+    files_dir = data_dir.parent / "files"
+    try:
+        if not (data_dir / "sales.csv").exists():
+            t0 = time.perf_counter()
+            generate_dataset(data_dir, seed=opts.seed, **scale)
+            print(f"datos generados en {data_dir} ({time.perf_counter() - t0:.1f}s)", flush=True)
+        results: Dict[str, Any] = {}
+        temps = {"cold": (True,), "warm": (False,), "both": (True, False)}[opts.cache]
+        for cold in temps:
+            suffix = "" if cold else "_warm"
+            if opts.mode in ("gunicorn", "both"):
+                results["gunicorn" + suffix] = bench_gunicorn(data_dir, files_dir, opts.requests, opts.concurrency,
+                                                              opts.workers, opts.threads, cold)
+            if opts.mode in ("inproc", "both"):
+                results["inproc" + suffix] = bench_inproc(data_dir, files_dir, opts.iterations, opts.warmup, cold)
+        report = {"meta": {"commit": git_commit(), "timestamp": datetime.now().isoformat(),
+                           "python": platform.python_version(), "platform": platform.platform(),
+                           "pandas": pd.__version__, "numpy": np.__version__, "scale": scale,
+                           "seed": opts.seed, "mode": opts.mode, "cache": opts.cache},
+                  "results": results}
+        opts.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"resultados en {opts.output}")
+        if opts.compare:
+            return 1 if compare(report, json.loads(opts.compare.read_text(encoding="utf-8")), opts.threshold) else 0
+        return 0
+    finally:
+        if tmp: shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,25 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import pandas as pd
-import os, io, csv, uuid, json, glob, base64, pathlib, re
+import numpy as np
+import os, io, csv, uuid, json, time, zlib, math, heapq, pickle, base64, hashlib, pathlib, re, shutil, tempfile, threading, contextlib, unicodedata
+import atexit, random, logging, cProfile, pstats, tracemalloc, statistics, multiprocessing, select, struct, ctypes, ctypes.util
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import contextvars
+try:
+    import fcntl
+except ImportError:   # Windows: solo se serializa dentro del proceso
+    fcntl = None
 
 
 BASE_DIR = pathlib.Path(__file__).parent.resolve()
-DATA_DIR = BASE_DIR / "data"
-FILES_DIR = BASE_DIR / "files"     
+DATA_DIR = pathlib.Path(os.getenv("MCP_DATA_DIR") or BASE_DIR / "data")
+FILES_DIR = pathlib.Path(os.getenv("MCP_FILES_DIR") or BASE_DIR / "files")
 DOCS_DIR = DATA_DIR / "docs"       
 for d in [DATA_DIR, FILES_DIR, DOCS_DIR]:
     d.mkdir(parents=True, exist_ok=True)
@@ -46,234 +57,2362 @@ def rpc_err(req_id: str, message: str, code: int = -32000) -> Dict[str, Any]:
 def text_piece(text: str) -> Dict[str, str]:
     return {"type":"text","text":text}
 
-def tool_result(text: str, is_error: bool = False) -> Dict[str, Any]:
-    return {"content":[text_piece(text)], "isError": is_error}
+def tool_result(text: str, is_error: bool = False, structured: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    out = {"content":[text_piece(text)], "isError": is_error}
+    if structured is not None:
+        out["structuredContent"] = structured
+    return out
 
-def load_sales() -> pd.DataFrame:
-    return pd.read_csv(SALES_CSV, encoding="utf-8")
+# Herramientas en streaming: generadores que emiten bloques de líneas (text_piece) y, al terminar,
+# devuelven (return) los metadatos del resultado: {"isError": ..., "structuredContent": ...}.
+STREAM_CHUNK_LINES = int(os.getenv("STREAM_CHUNK_LINES", "500"))
 
-def load_inventory() -> pd.DataFrame:
-    return pd.read_csv(INV_CSV, encoding="utf-8")
+def collect_stream(gen) -> Dict[str, Any]:
+    texts = []
+    while True:
+        try:
+            texts.append(next(gen)["text"])
+        except StopIteration as stop:
+            meta = stop.value or {}
+            return tool_result("\n".join(texts), meta.get("isError", False), meta.get("structuredContent"))
+
+def stream_lines(lines) -> Any:
+    # agrupa un iterable de líneas en bloques de STREAM_CHUNK_LINES
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= STREAM_CHUNK_LINES:
+            yield text_piece("\n".join(block)); block = []
+    if block:
+        yield text_piece("\n".join(block))
+
+SALES_DTYPES = {"date":"datetime64[ns]","month":"category","product":"category","units":"int64","unit_price":"float64"}
+INV_DTYPES   = {"product":"category","stock":"int64","min_required":"int64"}
+
+
+STORAGE_BACKEND = os.getenv("MCP_STORAGE", "npy").lower()   # npy (columnar, mmap) | csv
+SORT_KEYS = {"sales": "date"}   # el store npy mantiene las filas ordenadas por esta columna
+
+MONTHS = ["Enero","Febrero","Marzo","Abril","Mayo","Junio","Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+MONTH_NUMBERS = dict({m.lower(): i + 1 for i, m in enumerate(MONTHS)}, setiembre=9)
+# año de las filas que solo traen 'month': columna 'year' > argumento > SALES_DEFAULT_YEAR > (migración) año del
+# mtime del archivo de origen > (ingesta) año en curso. Así migrar el mismo CSV da lo mismo en cualquier año.
+SALES_DEFAULT_YEAR = int(os.environ["SALES_DEFAULT_YEAR"]) if os.getenv("SALES_DEFAULT_YEAR") else None
+
+def _is_date(dtype: str) -> bool:
+    return dtype.startswith("datetime64")
+
+def source_year(path: pathlib.Path) -> int:
+    return SALES_DEFAULT_YEAR or datetime.fromtimestamp(os.stat(path).st_mtime).year
+
+def normalize_sales(df: pd.DataFrame, default_year: Optional[int] = None) -> pd.DataFrame:
+    # 'date' es opcional en el CSV: si falta se usa el primer día del mes (month + year opcional,
+    # por defecto default_year); si falta 'month' se deriva de 'date'
+    if "date" in df.columns:
+        dates = pd.to_datetime(df["date"])
+        if "month" not in df.columns:
+            df = df.assign(month=np.array(MONTHS)[dates.dt.month.to_numpy() - 1])
+    elif "month" in df.columns:
+        num = df["month"].astype(str).str.strip().str.lower().map(MONTH_NUMBERS)
+        if num.isna().any():
+            raise ValueError(f"mes desconocido: {df['month'][num.isna()].iloc[0]!r}")
+        year = pd.to_numeric(df["year"]) if "year" in df.columns else (default_year or SALES_DEFAULT_YEAR or datetime.now().year)
+        dates = pd.to_datetime(pd.DataFrame({"year": year, "month": num, "day": 1}))
+    else:
+        return df
+    if dates.isna().any():
+        raise ValueError("fecha vacía")
+    return df.assign(date=dates.astype("datetime64[ns]"))
+
+
+class StaleVersionError(OSError):
+    pass
+
+def version_id(version: tuple) -> str:
+    return "-".join(str(v) for v in version)
+
+
+class CsvStore:
+    # Backend de texto: versión = (mtime, tamaño, inodo) del CSV. Se mantiene para compatibilidad.
+    # Al publicar, la versión anterior queda como hard link ".<nombre>.<inodo>" para los lectores que la
+    # tienen fijada, hasta que la recolecta gc().
+    name = "csv"
+    def __init__(self, path: pathlib.Path, dtypes: Dict[str, str]):
+        self.path, self.dtypes = path, dtypes
+        self.columns = list(dtypes)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def version(self) -> tuple:
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _retained(self, version: tuple) -> pathlib.Path:
+        return self.path.with_name(f".{self.path.name}.{version[2]}")
+
+    def _open(self, version: tuple):
+        # abre exactamente esa versión: el archivo actual o, si ya se reemplazó, su enlace retenido
+        for path in (self.path, self._retained(version)):
+            try:
+                fh = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            st = os.fstat(fh.fileno())
+            if (st.st_mtime_ns, st.st_size, st.st_ino) == tuple(version): return fh
+            fh.close()
+        raise StaleVersionError(f"la versión {version_id(version)} de {self.path.name} ya no está disponible")
+
+    def stored_columns(self, version: tuple) -> List[str]:
+        with self._open(version) as fh:
+            return list(pd.read_csv(fh, encoding="utf-8", nrows=0).columns)
+
+    def _read(self, src, columns: Optional[List[str]] = None, **kw):
+        cols = columns or self.columns
+        return pd.read_csv(src, encoding="utf-8", usecols=cols,
+                           dtype={c: t for c, t in self.dtypes.items() if c in cols and not _is_date(t)},
+                           parse_dates=[c for c, t in self.dtypes.items() if c in cols and _is_date(t)], **kw)
+
+    def read(self, version: tuple, columns: List[str]) -> Dict[str, pd.Series]:
+        # el CSV hay que parsearlo completo de todos modos: se devuelven todas las columnas
+        with self._open(version) as fh:
+            df = self._read(fh)
+        return {c: df[c] for c in df.columns}
+
+    def iter_chunks(self, version: tuple, chunksize: int, columns: Optional[List[str]] = None):
+        with self._open(version) as fh:
+            yield from self._read(fh, columns, chunksize=chunksize)
+
+    def row_count(self, version: tuple) -> Optional[int]:
+        return None
+
+    def sorted_by(self, version: tuple) -> Optional[str]:
+        return None
+
+    def load_table(self, version: tuple, name: str) -> Optional[pd.DataFrame]:
+        return None
+
+    def save_table(self, version: tuple, name: str, table: pd.DataFrame) -> None:
+        pass
+
+    def open_writer(self) -> "CsvWriter":
+        return CsvWriter(self)
+
+    def gc(self, pinned=(), grace: float = 0.0) -> List[str]:
+        # enlaces retenidos sin lectores fijados y retirados hace más de 'grace' s (ctime = creación del enlace)
+        now, removed = time.time(), []
+        for path in self.path.parent.glob(f".{self.path.name}.*"):
+            if path.name.endswith(".tmp"): continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if (st.st_mtime_ns, st.st_size, st.st_ino) in pinned or now - st.st_ctime < grace: continue
+            with contextlib.suppress(OSError):
+                path.unlink(); removed.append(path.name)
+        return removed
+
+
+class CsvWriter:
+    # escribir a temporal + rename: los lectores (otros hilos/workers) nunca ven un archivo a medias
+    def __init__(self, store: CsvStore):
+        self.store, self.rows = store, 0
+        self.tmp = store.path.with_name(f".{store.path.name}.{uuid.uuid4().hex}.tmp")
+        self._fh = open(self.tmp, "w", encoding="utf-8", newline="")
+        self._header_written = False
+
+    def append(self, df: pd.DataFrame) -> None:
+        # la cabecera va una sola vez: un bloque vacío (p.ej. upsert que reemplaza todo) no la repite
+        df[self.store.columns].to_csv(self._fh, index=False, header=not self._header_written)
+        self._header_written = True
+        self.rows += len(df)
+
+    def commit(self) -> tuple:
+        if not self._header_written:
+            pd.DataFrame(columns=self.store.columns).to_csv(self._fh, index=False)
+        self._fh.close()
+        with contextlib.suppress(OSError):   # primera escritura o FS sin hard links: no hay nada que retener
+            os.link(self.store.path, self.store._retained(self.store.version()))
+        os.replace(self.tmp, self.store.path)
+        VERSION_GC.collect(self.store)
+        return self.store.version()
+
+    def abort(self) -> None:
+        self._fh.close()
+        if self.tmp.exists(): self.tmp.unlink()
+
+
+class NpyStore:
+    # Backend columnar: un .npy por columna (categorías como códigos int32 + lista en meta.json),
+    # leído con mmap y por columnas. Cada escritura crea un directorio inmutable "<base>.<token>"
+    # y luego reemplaza atómicamente el puntero "<base>.current" con su nombre.
+    name = "npy"
+
+    def __init__(self, base: pathlib.Path, dtypes: Dict[str, str], sort_by: Optional[str] = None):
+        self.base, self.dtypes, self.sort_by = base, dtypes, sort_by
+        self.columns = list(dtypes)
+        self.pointer = base.with_name(base.name + ".current")
+
+    def exists(self) -> bool:
+        return self.pointer.exists()
+
+    def version(self) -> tuple:
+        return (self.pointer.read_text(encoding="utf-8").strip(),)
+
+    def _dir(self, version: tuple) -> pathlib.Path:
+        return self.base.with_name(version[0])
+
+    def _meta(self, version: tuple) -> Dict[str, Any]:
+        return json.loads((self._dir(version) / "meta.json").read_text(encoding="utf-8"))
+
+    def stored_columns(self, version: tuple) -> List[str]:
+        d = self._dir(version)
+        return [c for c in self.columns if (d / f"{c}.npy").exists()]
+
+    def read(self, version: tuple, columns: List[str]) -> Dict[str, pd.Series]:
+        meta, d = self._meta(version), self._dir(version)
+        out = {}
+        for c in columns:
+            arr = np.load(d / f"{c}.npy", mmap_mode="r")
+            cats = meta["categories"].get(c)
+            if cats is not None:
+                out[c] = pd.Series(pd.Categorical.from_codes(arr, categories=cats), name=c)
+            else:
+                out[c] = pd.Series(arr, name=c, copy=False)
+        return out
+
+    def iter_chunks(self, version: tuple, chunksize: int, columns: Optional[List[str]] = None):
+        columns = columns or self.columns
+        cols = self.read(version, columns)
+        n = self.row_count(version)
+        for i in range(0, n, chunksize):
+            yield pd.DataFrame({c: cols[c].iloc[i:i+chunksize].reset_index(drop=True) for c in columns})
+
+    def row_count(self, version: tuple) -> Optional[int]:
+        return int(self._meta(version)["rows"])
+
+    def sorted_by(self, version: tuple) -> Optional[str]:
+        return self._meta(version).get("sorted_by")
+
+    def load_table(self, version: tuple, name: str) -> Optional[pd.DataFrame]:
+        # tablas derivadas pequeñas (p.ej. agregados) guardadas junto a las columnas de esa versión
+        try:
+            return pd.read_pickle(self._dir(version) / f"{name}.pkl")
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+
+    def save_table(self, version: tuple, name: str, table: pd.DataFrame) -> None:
+        path = self._dir(version) / f"{name}.pkl"
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with contextlib.suppress(OSError):   # versión ya recolectada: solo se pierde el atajo
+            table.to_pickle(tmp)
+            os.replace(tmp, path)
+
+    def open_writer(self) -> "NpyWriter":
+        return NpyWriter(self)
+
+    def publish(self, token: str) -> tuple:
+        ptr_tmp = self.pointer.with_name(f".{self.pointer.name}.{uuid.uuid4().hex}.tmp")
+        ptr_tmp.write_text(token, encoding="utf-8")
+        os.replace(ptr_tmp, self.pointer)
+        VERSION_GC.collect(self)
+        return (token,)
+
+    def gc(self, pinned=(), grace: float = 0.0) -> List[str]:
+        # versiones anteriores a la actual sin lectores fijados y retiradas hace más de 'grace' s
+        # (retirada = creación de la versión siguiente; los nombres ordenan cronológicamente)
+        try:
+            current = self.version()[0]
+        except OSError:
+            return []
+        dirs = sorted(p for p in self.base.parent.glob(self.base.name + ".*") if p.is_dir())
+        now, removed = time.time(), []
+        for path, successor in zip(dirs, dirs[1:]):
+            if path.name == current or (path.name,) in pinned: continue
+            try:
+                if now - successor.stat().st_mtime < grace: continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path.name)
+        return removed
+
+
+class NpyWriter:
+    # Escritura por bloques con memoria acotada: cada columna se vuelca a un .raw binario y al final
+    # se convierte a .npy copiando por bloques. Las categorías se codifican con un diccionario incremental.
+    COPY_BLOCK = 1 << 20
+
+    def __init__(self, store: NpyStore):
+        self.store, self.rows = store, 0
+        self.token = f"{store.base.name}.{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        self.tmp = store.base.with_name(f".{self.token}.tmp")
+        self.tmp.mkdir()
+        self._files = {c: open(self.tmp / f"{c}.raw", "wb") for c in store.columns}
+        self._cats: Dict[str, List[str]] = {c: [] for c, t in store.dtypes.items() if t == "category"}
+
+    def _dtype(self, c: str) -> np.dtype:
+        return np.dtype(np.int32) if c in self._cats else np.dtype(self.store.dtypes[c])
+
+    def _encode(self, c: str, values: pd.Series) -> np.ndarray:
+        known = self._cats[c]
+        vals = values.astype("string").astype(object)
+        seen = set(known)
+        for u in pd.unique(vals.dropna()):
+            if u not in seen:
+                known.append(u); seen.add(u)
+        return pd.Categorical(vals, categories=known).codes.astype(np.int32)
+
+    def append(self, df: pd.DataFrame) -> None:
+        for c, fh in self._files.items():
+            arr = self._encode(c, df[c]) if c in self._cats else df[c].to_numpy(dtype=self._dtype(c))
+            np.ascontiguousarray(arr).tofile(fh)
+        self.rows += len(df)
+
+    def _sort_order(self) -> Optional[np.ndarray]:
+        # permutación que ordena por la clave; None si ya llegó ordenado (p.ej. appends de datos más nuevos)
+        key = self.store.sort_by
+        if not key or self.rows < 2: return None
+        vals = np.memmap(self.tmp / f"{key}.raw", dtype=self._dtype(key), mode="r", shape=(self.rows,))
+        if (vals[1:] >= vals[:-1]).all(): return None
+        return np.argsort(vals, kind="stable")
+
+    def commit(self) -> tuple:
+        for fh in self._files.values(): fh.close()
+        order = self._sort_order()
+        for c in self._files:
+            raw = self.tmp / f"{c}.raw"
+            dtype = self._dtype(c)
+            out = np.lib.format.open_memmap(self.tmp / f"{c}.npy", mode="w+", dtype=dtype, shape=(self.rows,))
+            if order is None:
+                with open(raw, "rb") as src:
+                    for i in range(0, self.rows, self.COPY_BLOCK):
+                        block = np.fromfile(src, dtype=dtype, count=min(self.COPY_BLOCK, self.rows - i))
+                        out[i:i+len(block)] = block
+            else:
+                src = np.memmap(raw, dtype=dtype, mode="r", shape=(self.rows,))
+                for i in range(0, self.rows, self.COPY_BLOCK):
+                    out[i:i+self.COPY_BLOCK] = src[order[i:i+self.COPY_BLOCK]]
+                del src
+            out.flush(); del out
+            raw.unlink()
+        meta = {"rows": self.rows, "categories": {c: [str(x) for x in v] for c, v in self._cats.items()}}
+        if self.store.sort_by: meta["sorted_by"] = self.store.sort_by
+        (self.tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(self.tmp, self.store.base.with_name(self.token))
+        return self.store.publish(self.token)
+
+    def abort(self) -> None:
+        for fh in self._files.values(): fh.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class _CacheEntry:
+    __slots__ = ("sig", "columns", "derived", "lock")
+    def __init__(self, sig: Optional[tuple], columns: Optional[Dict[str, pd.Series]] = None, derived: Optional[Dict[str, Any]] = None):
+        self.sig, self.columns, self.derived = sig, dict(columns or {}), dict(derived or {})
+        self.lock = threading.Lock()
+
+
+class DatasetCache:
+    # Cache de columnas por proceso; se recarga solo si cambia la versión del store
+    # (puntero npy o mtime/tamaño/inodo del CSV). Las columnas se cargan bajo demanda.
+    # Los DataFrames devueltos son compartidos entre hilos: no mutarlos (usar assign/copy).
+    # Cada entrada guarda además valores derivados (p.ej. agregados) válidos solo para esa versión.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _CacheEntry] = {}
+        self.stats = {"hits":0, "misses":0, "reloads":0, "column_loads":0}
+
+    @staticmethod
+    def key(store) -> str:
+        return store.name + ":" + str(getattr(store, "base", None) or store.path)
+
+    def entry(self, store) -> _CacheEntry:
+        key = self.key(store)
+        pinned = _SNAPSHOT.get()
+        if pinned is not None and key in pinned:
+            return pinned[key]
+        sig = store.version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.sig == sig:
+                self.stats["hits"] += 1
+                return entry
+            self.stats["reloads" if key in self._entries else "misses"] += 1
+            entry = self._entries[key] = _CacheEntry(sig)
+            return entry
+
+    def frame(self, store, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        entry = self.entry(store)
+        cols = list(columns or store.columns)
+        if any(c not in entry.columns for c in cols):
+            with entry.lock:
+                missing = [c for c in cols if c not in entry.columns]
+                if missing:
+                    with timed_phase("load"):
+                        entry.columns.update(store.read(entry.sig, missing))
+                    with self._lock: self.stats["column_loads"] += len(missing)
+        return pd.DataFrame({c: entry.columns[c] for c in cols}, copy=False)
+
+    def derived(self, store, name: str, builder, columns: Optional[List[str]] = None, stored=None) -> Any:
+        # 'stored': clase con atributo .table y constructor desde esa tabla; el valor se persiste con la
+        # versión del store (npy) y los demás workers lo cargan en vez de recalcularlo
+        entry = self.entry(store)
+        value = entry.derived.get(name)
+        if value is None:
+            table = store.load_table(entry.sig, name) if stored is not None else None
+            if table is not None:
+                value = stored(table)
+            else:
+                value = builder(self.frame(store, columns))
+                if stored is not None: store.save_table(entry.sig, name, value.table)
+            with entry.lock: entry.derived[name] = value
+        return value
+
+    def peek_derived(self, store, name: str) -> Any:
+        return self.entry(store).derived.get(name)
+
+    def put(self, store, version: tuple, df: Optional[pd.DataFrame] = None, derived: Optional[Dict[str, Any]] = None) -> None:
+        # siembra la caché tras una escritura propia (evita releer y recalcular lo recién escrito)
+        key = self.key(store)
+        entry = _CacheEntry(version, {c: df[c] for c in store.columns} if df is not None else None, derived)
+        with self._lock:
+            self._entries[key] = entry
+
+    def nbytes(self, store) -> int:
+        with self._lock:
+            entry = self._entries.get(self.key(store))
+        if entry is None: return 0
+        # otros hilos agregan columnas/derivados a la entrada: se mide una copia tomada bajo su lock
+        with entry.lock:
+            values = list(entry.columns.values()) + list(entry.derived.values())
+        return approx_nbytes(values)
+
+    def drop(self, store) -> None:
+        with self._lock:
+            self._entries.pop(self.key(store), None)
+
+    def snapshot_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries))
+
+DATA_CACHE = DatasetCache()
+
+# versión fijada de cada dataset para el contexto actual (p.ej. todas las llamadas de un batch)
+_SNAPSHOT: contextvars.ContextVar = contextvars.ContextVar("mcp_snapshot", default=None)
+
+VERSION_GRACE_SECS = float(os.getenv("MCP_VERSION_GRACE_SECS", "300"))
+VERSION_GC_SECS = float(os.getenv("MCP_VERSION_GC_SECS", "60"))
+
+
+class VersionGC:
+    # Las versiones de cada dataset son inmutables: los escritores publican una nueva y los lectores fijan la
+    # suya (data_snapshot). Una versión retirada se borra cuando ningún lector de este proceso la tiene fijada
+    # y pasaron 'grace' segundos (la gracia cubre a los lectores de otros workers, que este proceso no ve).
+    # Se recolecta al publicar y, en segundo plano, cada 'interval' segundos.
+    def __init__(self, grace: float, interval: float):
+        self.grace, self.interval = grace, interval
+        self._lock = threading.Lock()
+        self._pins: Dict[Tuple[str, tuple], int] = {}
+        self._pid = 0
+        self.removed = 0
+
+    def pin(self, pinned: Dict[str, _CacheEntry]) -> List[Tuple[str, tuple]]:
+        # devuelve las (clave, versión) fijadas, que se pasan luego a unpin
+        pins = [(key, entry.sig) for key, entry in pinned.items()]
+        with self._lock:
+            for k in pins: self._pins[k] = self._pins.get(k, 0) + 1
+        return pins
+
+    def unpin(self, pins: List[Tuple[str, tuple]]) -> None:
+        with self._lock:
+            for k in pins:
+                if self._pins.get(k, 0) <= 1: self._pins.pop(k, None)
+                else: self._pins[k] -= 1
+
+    def collect(self, store) -> int:
+        key = DatasetCache.key(store)
+        with self._lock:
+            pinned = {sig for k, sig in self._pins if k == key}
+        removed = store.gc(pinned, self.grace)
+        if removed:
+            with self._lock: self.removed += len(removed)
+        return len(removed)
+
+    def ensure_running(self) -> None:
+        # hilo por proceso, creado en el primer uso (los workers de gunicorn lo arrancan tras el fork)
+        if self._pid == os.getpid() or self.interval <= 0: return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="version-gc", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            for t in TENANTS.open_tenants():
+                for store in t.stores():
+                    try:
+                        self.collect(store)
+                    except OSError:
+                        logging.getLogger("mcp.storage").exception("error recolectando versiones de %s", DatasetCache.key(store))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pinned: Dict[str, List[str]] = {}
+            for key, sig in self._pins:
+                if sig is not None: pinned.setdefault(key, []).append(version_id(sig))
+            return {"grace_secs": self.grace, "pinned": pinned, "removed": self.removed}
+
+VERSION_GC = VersionGC(VERSION_GRACE_SECS, VERSION_GC_SECS)
+
+
+def make_store(kind: str, data_dir: pathlib.Path = DATA_DIR):
+    dtypes = SALES_DTYPES if kind == "sales" else INV_DTYPES
+    csv_path = data_dir / f"{kind}.csv"
+    if STORAGE_BACKEND == "csv":
+        store = CsvStore(csv_path, dtypes)
+    else:
+        store = NpyStore(data_dir / f"{kind}.npy", dtypes, SORT_KEYS.get(kind))
+    if store.exists() and not set(store.columns) - set(store.stored_columns(store.version())):
+        return store   # caso habitual: nada que migrar, sin esperar el lock de una ingesta en curso
+    with dataset_write_lock(kind, data_dir):
+        if not store.exists() and not csv_path.exists():
+            _write_chunks(store, [])   # tenant nuevo: dataset vacío
+        elif not store.exists():
+            # migración automática desde el CSV existente
+            with open(csv_path, "rb") as fh:
+                _write_chunks(store, _read_csv_chunks(fh, kind, year=source_year(csv_path)))
+        else:
+            version = store.version()
+            stored = store.stored_columns(version)
+            if set(store.columns) - set(stored):
+                # datos anteriores a una columna nueva (p.ej. 'date' en ventas): se reescriben una vez
+                year = source_year(store.path if isinstance(store, CsvStore) else store._dir(version))
+                _write_chunks(store, (normalize_dataset(kind, ch, year) for ch in store.iter_chunks(version, INGEST_CHUNK_ROWS, stored)))
+    return store
+
+def _write_chunks(store, chunks) -> tuple:
+    writer = store.open_writer()
+    try:
+        for chunk in chunks: writer.append(chunk)
+        return writer.commit()
+    except BaseException:
+        writer.abort(); raise
+
+class SalesAggregates:
+    # Tabla materializada (mes, producto) -> units/revenue + totales por mes, por producto y global.
+    # Es pequeña (meses x productos), así que resumen/top son búsquedas y no recorren las ventas.
+    def __init__(self, by_month_product: pd.DataFrame):
+        by_month_product = by_month_product.astype({"month": str, "product": str})
+        mp = by_month_product.groupby(["month","product"], as_index=False, sort=False)[["units","revenue"]].sum()
+        mp["month_key"] = mp["month"].str.lower()
+        self.by_month_product = mp
+        self.by_month = mp.groupby("month_key", sort=False)[["units","revenue"]].sum()
+        self.by_product = mp.groupby("product", sort=False)[["units","revenue"]].sum()
+        self.total_units = int(self.by_product["units"].sum())
+        self.total_revenue = float(self.by_product["revenue"].sum())
+
+    @property
+    def table(self) -> pd.DataFrame:
+        return self.by_month_product[["month","product","units","revenue"]]
+
+    @staticmethod
+    def _codes(col: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+        # códigos enteros (-1 = nulo) + etiquetas
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            return col.cat.codes.to_numpy().astype(np.int64), col.cat.categories.astype(str).to_numpy(dtype=object)
+        codes, labels = pd.factorize(col)
+        return codes.astype(np.int64), np.asarray(labels).astype(str).astype(object)
+
+    @classmethod
+    def from_sales(cls, df: pd.DataFrame) -> "SalesAggregates":
+        # agregación sobre códigos de categoría con bincount; solo la tabla resultante lleva etiquetas
+        m_codes, months = cls._codes(df["month"])
+        p_codes, products = cls._codes(df["product"])
+        units = df["units"].to_numpy()
+        revenue = units * df["unit_price"].to_numpy() if "unit_price" in df else np.full(len(units), np.nan)
+        key = m_codes * len(products) + p_codes
+        valid = (m_codes >= 0) & (p_codes >= 0)   # filas sin mes o producto quedan fuera, como en groupby
+        if not valid.all(): key, units, revenue = key[valid], units[valid], revenue[valid]
+        size = len(months) * len(products)
+        counts = np.bincount(key, minlength=size)
+        nz = np.flatnonzero(counts)
+        mp = pd.DataFrame({
+            "month": months[nz // max(1, len(products))],
+            "product": products[nz % max(1, len(products))],
+            "units": np.bincount(key, weights=units, minlength=size)[nz].round().astype(np.int64),
+            "revenue": np.bincount(key, weights=revenue, minlength=size)[nz],
+        })
+        return cls(mp)
+
+    def merge(self, other: "SalesAggregates") -> "SalesAggregates":
+        # actualización incremental: solo se combinan las dos tablas pequeñas
+        cols = ["month","product","units","revenue"]
+        return SalesAggregates(pd.concat([self.by_month_product[cols], other.by_month_product[cols]], ignore_index=True))
+
+    def month_totals(self, month: Optional[str]) -> Tuple[float, pd.Series]:
+        if not month:
+            by_prod = self.by_product["revenue"]
+            return self.total_revenue, by_prod.sort_values(ascending=False)
+        mp = self.by_month_product
+        rows = mp[mp["month_key"] == str(month).lower()]
+        by_prod = rows.groupby("product", sort=False)["revenue"].sum().sort_values(ascending=False)
+        return float(by_prod.sum()), by_prod
+
+    def top(self, n: int, key: str = "revenue") -> pd.Series:
+        vals = self.by_product[key].to_numpy()
+        n = max(0, min(n, len(vals)))
+        if n == 0: return self.by_product[key].iloc[:0]
+        # selección parcial O(P) + orden solo de los n elegidos
+        idx = np.argpartition(-vals, n-1)[:n] if n < len(vals) else np.arange(len(vals))
+        idx = idx[np.argsort(-vals[idx], kind="stable")]
+        return self.by_product[key].iloc[idx]
+
+def load_sales_aggregates() -> SalesAggregates:
+    return DATA_CACHE.derived(sales_store(), "aggregates", SalesAggregates.from_sales, stored=SalesAggregates)
+
+def load_sales(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return DATA_CACHE.frame(sales_store(), columns)
+
+def load_inventory(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    return DATA_CACHE.frame(inv_store(), columns)
+
+
+class TimeIndex:
+    # Fechas de ventas en orden (int64 ns). Si el store ya está ordenado por fecha (npy) no hay permutación
+    # y un rango es un slice contiguo de las columnas mmap; si no (CSV), se ordena una vez por versión.
+    __slots__ = ("dates", "order")
+    def __init__(self, dates: np.ndarray, order: Optional[np.ndarray]):
+        self.dates, self.order = dates, order
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, presorted: bool) -> "TimeIndex":
+        dates = df["date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        if presorted or (dates[1:] >= dates[:-1]).all():
+            return cls(dates, None)
+        order = np.argsort(dates, kind="stable")
+        return cls(dates[order], order)
+
+    def span(self, start: Optional[np.datetime64], end: Optional[np.datetime64]) -> Tuple[int, int]:
+        # [start, end) con búsqueda binaria
+        lo = 0 if start is None else int(np.searchsorted(self.dates, start.astype("datetime64[ns]").astype(np.int64), "left"))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, end.astype("datetime64[ns]").astype(np.int64), "left"))
+        return lo, max(lo, hi)
+
+    def take(self, values: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        return values[lo:hi] if self.order is None else values[self.order[lo:hi]]
+
+def load_time_index() -> TimeIndex:
+    version = DATA_CACHE.entry(sales_store()).sig
+    presorted = sales_store().sorted_by(version) == "date"
+    return DATA_CACHE.derived(sales_store(), "time_index", lambda df: TimeIndex.build(df, presorted), ["date"])
+
+VELOCITY_WEEKS = int(os.getenv("VELOCITY_WEEKS", "12"))
+
+class DemandHistory:
+    # Unidades vendidas por producto y semana (matriz productos x VELOCITY_WEEKS, la última columna es la semana
+    # que termina en la última venta registrada). Se deriva una vez por versión y se precalcula al ingerir.
+    __slots__ = ("products", "weekly", "end")
+    def __init__(self, products: pd.Index, weekly: np.ndarray, end: Optional[str]):
+        self.products, self.weekly, self.end = products, weekly, end
+
+    @classmethod
+    def build(cls, weeks: int = VELOCITY_WEEKS) -> "DemandHistory":
+        idx = load_time_index()
+        products = load_sales(["product"])["product"].cat.categories
+        if not len(idx.dates):
+            return cls(products, np.zeros((len(products), weeks), dtype=np.float32), None)
+        last_day = int(idx.dates[-1]) // _NS_PER_DAY
+        lo, hi = idx.span(np.datetime64(last_day - 7 * weeks + 1, "D"), None)
+        sales = load_sales(["product","units"])
+        codes = idx.take(sales["product"].cat.codes.to_numpy(), lo, hi).astype(np.int64)
+        units = idx.take(sales["units"].to_numpy(), lo, hi)
+        col = (weeks - 1) - (last_day - idx.dates[lo:hi] // _NS_PER_DAY) // 7
+        valid = codes >= 0   # ventas sin producto (código -1) no cuentan para ninguna fila
+        if not valid.all(): codes, units, col = codes[valid], units[valid], col[valid]
+        flat = np.bincount(codes * weeks + col, weights=units, minlength=len(products) * weeks)
+        return cls(products, flat.reshape(len(products), weeks).astype(np.float32), str(np.datetime64(last_day, "D")))
+
+    def forecast(self, method: str = "ema", alpha: float = 0.3, window: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        # demanda diaria estimada y su desviación, para todos los productos a la vez
+        hist = self.weekly.astype(np.float64)
+        if method == "ma":
+            weekly = hist[:, -max(1, min(window, hist.shape[1])):].mean(axis=1)
+        else:
+            weekly = hist[:, 0].copy()
+            for j in range(1, hist.shape[1]):
+                weekly += alpha * (hist[:, j] - weekly)
+        return weekly / 7.0, hist.std(axis=1) / math.sqrt(7.0)
+
+    def align(self, products: pd.Series, *values: np.ndarray) -> List[np.ndarray]:
+        # proyecta valores por producto de ventas sobre las filas de inventario (vía categorías, no por fila)
+        pos = self.products.get_indexer(products.cat.categories.astype(str))
+        codes = products.cat.codes.to_numpy()
+        out = []
+        for v in values:
+            per_cat = np.append(np.where(pos >= 0, v[np.maximum(pos, 0)] if len(v) else 0.0, 0.0), 0.0)
+            out.append(per_cat[codes])
+        return out
+
+def load_demand() -> DemandHistory:
+    return DATA_CACHE.derived(sales_store(), "demand", lambda df: DemandHistory.build(), ["date"])
+
+def pin_datasets(tenant: Optional["Tenant"] = None) -> Dict[str, _CacheEntry]:
+    return {DatasetCache.key(st): DATA_CACHE.entry(st) for st in (tenant or current_tenant()).stores()}
+
+@contextlib.contextmanager
+def data_snapshot(tenant_ids: Optional[List[Optional[str]]] = None):
+    # fija la versión actual de ventas/inventario (de cada tenant indicado; por defecto el actual):
+    # lecturas consistentes aunque haya ingestas en paralelo. Anidado, respeta lo fijado por el contexto exterior.
+    VERSION_GC.ensure_running()
+    pinned: Dict[str, _CacheEntry] = dict(_SNAPSHOT.get() or {})
+    for tid in tenant_ids or [None]:
+        try:
+            pinned.update(pin_datasets(None if tid is None else TENANTS.get(tid)))
+        except TenantError:
+            pass   # se informa en la llamada correspondiente
+    pins = VERSION_GC.pin(pinned)
+    token = _SNAPSHOT.set(pinned)
+    try:
+        yield pinned
+    finally:
+        _SNAPSHOT.reset(token)
+        VERSION_GC.unpin(pins)
+
+def dataset_rows(store) -> int:
+    n = store.row_count(DATA_CACHE.entry(store).sig)
+    return int(n) if n is not None else int(len(DATA_CACHE.frame(store)))
+
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+INGEST_MODES = ("replace", "append", "upsert")
+UPSERT_KEYS = {"sales": ["date","product"], "inventory": ["product"]}
+_WRITE_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_WRITE_LOCKS_GUARD = threading.Lock()
+
+
+class IngestError(ValueError):
+    pass
+
+
+@contextlib.contextmanager
+def dataset_write_lock(kind: str, data_dir: pathlib.Path):
+    # serializa escritores del mismo dataset (de cada tenant): hilos (Lock) y workers de gunicorn (flock)
+    with _WRITE_LOCKS_GUARD:
+        lock = _WRITE_LOCKS.setdefault((str(data_dir), kind), threading.Lock())
+    with lock:
+        with open(data_dir / f".{kind}.lock", "a") as fh:
+            if fcntl: fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl: fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _row_keys(df: pd.DataFrame, cols: List[str]) -> pd.Series:
+    keys = df[cols[0]].astype(str)
+    for c in cols[1:]:
+        keys = keys + "\x1f" + df[c].astype(str)
+    return keys
+
+def normalize_dataset(kind: str, df: pd.DataFrame, year: Optional[int] = None) -> pd.DataFrame:
+    return normalize_sales(df, year) if kind == "sales" else df
+
+def _read_csv_chunks(src, kind: str, usecols: Optional[List[str]] = None, year: Optional[int] = None):
+    dtypes = SALES_DTYPES if kind == "sales" else INV_DTYPES
+    label = "ventas" if kind == "sales" else "inventario"
+    start = 0
+    for chunk in pd.read_csv(src, encoding="utf-8", chunksize=INGEST_CHUNK_ROWS):
+        try:
+            chunk = normalize_dataset(kind, chunk, year)
+        except (ValueError, TypeError) as e:
+            raise IngestError(f"filas {start+2}-{start+len(chunk)+1}: {e}")
+        for col in (usecols or dtypes):
+            if col not in chunk.columns:
+                if kind == "sales" and col in ("date", "month"):
+                    raise IngestError(f"CSV {label} sin columna date ni month (se requiere al menos una)")
+                raise IngestError(f"CSV {label} sin columna {col}")
+        try:
+            chunk = chunk[list(usecols or dtypes)].astype({c: dtypes[c] for c in (usecols or dtypes)})
+        except (ValueError, TypeError) as e:
+            raise IngestError(f"filas {start+2}-{start+len(chunk)+1}: {e}")
+        start += len(chunk)
+        yield chunk
+
+
+# ---------- Tenants ----------
+DEFAULT_TENANT = os.getenv("MCP_DEFAULT_TENANT", "default")
+TENANTS_DIR = DATA_DIR / "tenants"
+TENANT_CACHE_BYTES = int(os.getenv("MCP_TENANT_CACHE_MB", "1024")) << 20
+MAX_TENANTS = int(os.getenv("MCP_MAX_TENANTS", "32"))
+_TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+class TenantError(ValueError):
+    pass
+
+
+class Tenant:
+    # Datasets de una tienda. El tenant por defecto usa DATA_DIR (compatibilidad); el resto DATA_DIR/tenants/<id>.
+    __slots__ = ("id", "data_dir", "files_prefix", "sales", "inventory", "active", "last_used")
+    def __init__(self, tid: str, data_dir: pathlib.Path):
+        self.id, self.data_dir = tid, data_dir
+        self.files_prefix = "" if tid == DEFAULT_TENANT else f"tenants/{tid}/"
+        self.sales = make_store("sales", data_dir)
+        self.inventory = make_store("inventory", data_dir)
+        self.active, self.last_used = 0, time.monotonic()
+
+    def stores(self) -> Tuple[Any, Any]:
+        return (self.sales, self.inventory)
+
+
+def approx_nbytes(obj: Any) -> int:
+    # tamaño aproximado de columnas/valores derivados (los arrays mmap cuentan completos)
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)): return int(obj.nbytes)
+    if isinstance(obj, pd.DataFrame): return int(obj.memory_usage(index=False).sum())
+    if isinstance(obj, dict): return sum(approx_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)): return sum(approx_nbytes(v) for v in obj)
+    slots = getattr(type(obj), "__slots__", None)
+    if slots: return sum(approx_nbytes(getattr(obj, a, None)) for a in slots)
+    return sum(approx_nbytes(v) for v in vars(obj).values()) if hasattr(obj, "__dict__") else 0
+
+
+class TenantRegistry:
+    # Tenants abiertos en orden LRU. Tras cada llamada, si hay más de MAX_TENANTS abiertos o sus cachés superan
+    # TENANT_CACHE_BYTES, se cierran los inactivos menos usados (se liberan sus entradas de DATA_CACHE).
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open: "OrderedDict[str, Tenant]" = OrderedDict()
+        self.evictions = 0
+
+    @staticmethod
+    def path(tid: str) -> pathlib.Path:
+        return DATA_DIR if tid == DEFAULT_TENANT else TENANTS_DIR / tid
+
+    def ids(self) -> List[str]:
+        others = sorted(p.name for p in TENANTS_DIR.glob("*") if p.is_dir() and _TENANT_ID_RE.match(p.name))
+        return [DEFAULT_TENANT] + [t for t in others if t != DEFAULT_TENANT]
+
+    def get(self, tid: Optional[str], create: bool = False) -> Tenant:
+        tid = str(tid or DEFAULT_TENANT).strip().lower()
+        if not _TENANT_ID_RE.match(tid): raise TenantError(f"tenant inválido: {tid!r}")
+        with self._lock:
+            t = self._open.get(tid)
+            if t is not None:
+                self._open.move_to_end(tid)
+                t.last_used = time.monotonic()
+                return t
+        path = self.path(tid)
+        if tid != DEFAULT_TENANT and not path.is_dir():
+            if not create: raise TenantError(f"tenant '{tid}' no existe")
+            path.mkdir(parents=True, exist_ok=True)
+        t = Tenant(tid, path)   # fuera del lock: abrir/migrar un tenant grande no bloquea a los demás
+        with self._lock:
+            t = self._open.setdefault(tid, t)
+            self._open.move_to_end(tid)
+            return t
+
+    def acquire(self, tid: Optional[str], create: bool = False) -> Tenant:
+        t = self.get(tid, create)
+        with self._lock: t.active += 1
+        return t
+
+    def release(self, t: Tenant) -> None:
+        with self._lock: t.active -= 1
+        try:
+            self.enforce_limits()
+        except Exception:   # la contabilidad de la caché nunca debe hacer fallar una llamada ya resuelta
+            logging.getLogger("mcp.tenants").exception("error aplicando los límites de tenants")
+
+    def enforce_limits(self) -> None:
+        with self._lock:
+            tenants = list(self._open.values())
+        sizes = {t.id: sum(DATA_CACHE.nbytes(st) for st in t.stores()) for t in tenants}
+        total = sum(sizes.values())
+        for t in tenants:   # del menos al más recientemente usado
+            if len(tenants) <= MAX_TENANTS and total <= TENANT_CACHE_BYTES: break
+            with self._lock:
+                if t.active or self._open.get(t.id) is not t: continue
+                del self._open[t.id]
+                self.evictions += 1
+            for st in t.stores(): DATA_CACHE.drop(st)
+            tenants.remove(t)
+            total -= sizes[t.id]
+
+    def open_tenants(self) -> List[Tenant]:
+        with self._lock:
+            return list(self._open.values())
+
+    def stats(self) -> Dict[str, Any]:
+        tenants = self.open_tenants()
+        return {"open": [t.id for t in tenants], "max_open": MAX_TENANTS, "evictions": self.evictions,
+                "cache_bytes": sum(DATA_CACHE.nbytes(st) for t in tenants for st in t.stores()),
+                "cache_limit_bytes": TENANT_CACHE_BYTES}
+
+TENANTS = TenantRegistry()
+
+# tenant de la llamada en curso (argumento "tenant" o cabecera X-Tenant; si no, el tenant por defecto)
+_TENANT: contextvars.ContextVar = contextvars.ContextVar("mcp_tenant", default=None)
+
+def current_tenant() -> Tenant:
+    t = _TENANT.get()
+    return t if t is not None else TENANTS.get(DEFAULT_TENANT)
+
+def sales_store():
+    return current_tenant().sales
+
+def inv_store():
+    return current_tenant().inventory
+
+@contextlib.contextmanager
+def use_tenant(tid: Optional[str] = None, create: bool = False):
+    # sin id explícito se mantiene el tenant ya activo en el contexto
+    t = TENANTS.acquire(tid if tid or _TENANT.get() is None else _TENANT.get().id, create)
+    token = _TENANT.set(t)
+    try:
+        yield t
+    finally:
+        _TENANT.reset(token)
+        TENANTS.release(t)
+
+
+class _CountingReader:
+    # envoltorio mínimo de lectura que cuenta bytes (el stream de la petición no es seekable)
+    def __init__(self, raw):
+        self.raw, self.nbytes = raw, 0
+
+    def read(self, n: int = -1) -> bytes:
+        data = self.raw.read(n)
+        self.nbytes += len(data)
+        return data
+
+    def seek(self, pos: int) -> None:
+        self.raw.seek(pos)
+        self.nbytes = 0
+
+    def __iter__(self):
+        return iter(lambda: self.read(1 << 16), b"")
+
+def ingest_stream(kind: str, src, mode: str = "replace", year: Optional[int] = None) -> Dict[str, Any]:
+    # Ingesta por bloques con memoria acotada. 'src' es un archivo binario (stream de la petición,
+    # archivo temporal, BytesIO). upsert necesita dos pasadas, así que primero se vuelca a disco.
+    if kind not in ("sales","inventory"): raise IngestError("kind debe ser 'sales' o 'inventory'")
+    if mode not in INGEST_MODES: raise IngestError(f"mode debe ser uno de {', '.join(INGEST_MODES)}")
+    tenant = current_tenant()
+    store = tenant.sales if kind == "sales" else tenant.inventory
+    t0 = time.perf_counter()
+    spool = None
+    if mode == "upsert" and not (getattr(src, "seekable", None) and src.seekable()):
+        spool = tempfile.TemporaryFile(dir=tenant.data_dir)
+        shutil.copyfileobj(src, spool, 1 << 20)
+        spool.seek(0)
+        src = spool
+    src = _CountingReader(src)
+    try:
+        with dataset_write_lock(kind, tenant.data_dir):
+            base_version = store.version()
+            new_keys = None
+            if mode == "upsert":
+                new_keys = set()
+                for chunk in _read_csv_chunks(src, kind, UPSERT_KEYS[kind], year):
+                    new_keys.update(_row_keys(chunk, UPSERT_KEYS[kind]).unique())
+                src.seek(0)
+            writer = store.open_writer()
+            aggs: Optional[SalesAggregates] = None
+            kept = 0
+            try:
+                if mode in ("append", "upsert"):
+                    entry = DATA_CACHE.entry(store)
+                    if kind == "sales" and mode == "append" and entry.sig == base_version:
+                        aggs = entry.derived.get("aggregates")
+                    for chunk in store.iter_chunks(base_version, INGEST_CHUNK_ROWS):
+                        if new_keys is not None:
+                            chunk = chunk[~_row_keys(chunk, UPSERT_KEYS[kind]).isin(new_keys).to_numpy()]
+                        writer.append(chunk)
+                        kept += len(chunk)
+                    if kind == "sales" and mode == "upsert": aggs = None
+                elif kind == "sales":
+                    aggs = SalesAggregates.from_sales(pd.DataFrame({c: pd.Series(dtype=t) for c, t in SALES_DTYPES.items()}))
+                rows = 0
+                for chunk in _read_csv_chunks(src, kind, year=year):
+                    writer.append(chunk)
+                    rows += len(chunk)
+                    if aggs is not None:
+                        aggs = aggs.merge(SalesAggregates.from_sales(chunk))
+                version = writer.commit()
+            except BaseException:
+                writer.abort(); raise
+            # RESULT_CACHE no se vacía: sus claves incluyen tenant y versión, lo obsoleto sale por LRU
+            DATA_CACHE.put(store, version, None, {"aggregates": aggs} if aggs is not None else None)
+            if aggs is not None: store.save_table(version, "aggregates", aggs.table)
+    finally:
+        if spool is not None: spool.close()
+    secs = time.perf_counter() - t0
+    if kind == "sales":
+        # historial de demanda listo para reorder_suggestions, fuera del snapshot de un batch. La versión ya
+        # está publicada: si el precálculo falla la ingesta sigue siendo válida (se recalcula en la próxima consulta)
+        ctx = contextvars.copy_context()
+        ctx.run(_SNAPSHOT.set, None)
+        try:
+            ctx.run(load_demand)
+        except Exception:
+            logging.getLogger("mcp.ingest").exception("error precalculando la demanda tras ingerir %s", kind)
+    return {"kind": kind, "mode": mode, "rows_ingested": rows, "rows_kept": kept, "rows_total": kept + rows,
+            "bytes": src.nbytes, "seconds": round(secs, 4),
+            "rows_per_sec": round(rows / secs, 1) if secs > 0 else None,
+            "mb_per_sec": round(src.nbytes / secs / 1e6, 3) if secs > 0 else None}
+
+def ingest_summary(st: Dict[str, Any]) -> str:
+    return (f"Datos '{st['kind']}' actualizados ({st['mode']}): {st['rows_ingested']} filas nuevas, "
+            f"{st['rows_total']} en total. {st['seconds']}s, {st['rows_per_sec']} filas/s, {st['mb_per_sec']} MB/s.")
 
 def to_currency(x: float) -> str:
     return f"${x:,.2f}"
 
 
-def llm_answer(query: str, context: str) -> str:
- 
+def llm_stream(query: str, context: str):
+    # punto de integración del modelo: emite la respuesta línea a línea a medida que se genera
     bullets = re.findall(r"\b\w+\b", query.lower())
     hints = ", ".join(sorted(set(bullets)))[:120]
-    return f"[LLM] Respuesta a: '{query}'. Contexto usado ({len(context)} chars). Palabras clave: {hints or 'n/a'}"
+    yield f"[LLM] Respuesta a: '{query}'. Contexto usado ({len(context)} chars). Palabras clave: {hints or 'n/a'}"
+
+CONTEXT_CRITICAL_TOP = int(os.getenv("LLM_CONTEXT_CRITICAL_TOP", "20"))
 
-def build_context(sales_df: pd.DataFrame, inv_df: pd.DataFrame, docs_text: str) -> str:
-    revenue = (sales_df["units"]*sales_df["unit_price"]).sum()
-    top_prod = sales_df.assign(revenue=sales_df["units"]*sales_df["unit_price"]) \
-                       .sort_values("revenue", ascending=False).head(1)
+def build_context(aggs: SalesAggregates, inv_df: pd.DataFrame, query: str, budget: int) -> str:
+    # el presupuesto se aplica al texto completo: KPIs, los N críticos con mayor faltante
+    # (el resto solo se cuenta) y los fragmentos de docs con lo que quede
+    revenue = aggs.total_revenue
+    top_prod = aggs.top(1, "revenue")
     top_line = ""
     if not top_prod.empty:
-        r = top_prod.iloc[0]
-        top_line = f"TOP: {r['product']} ({to_currency(r['revenue'])})"
-    critical = inv_df[inv_df["stock"] < inv_df["min_required"]]
-    crit_names = ", ".join(critical["product"].tolist()) if not critical.empty else "ninguno"
-    docs_excerpt = (docs_text[:300] + "...") if len(docs_text) > 300 else docs_text
-    return (
-        f"KPI ventas totales: {to_currency(revenue)} | {top_line}\n"
-        f"Inventario crítico: {crit_names}\n"
-        f"Docs: {docs_excerpt}"
-    )
-
-def read_all_docs() -> str:
-    chunks = []
-    for path in glob.glob(str(DOCS_DIR / "*.txt")):
+        top_line = f"TOP: {top_prod.index[0]} ({to_currency(top_prod.iloc[0])})"
+    short = inv_df["min_required"] - inv_df["stock"]
+    critical = inv_df.loc[short > 0, "product"]
+    names: List[str] = []
+    room = budget // 2
+    for name in critical.loc[short[short > 0].nlargest(CONTEXT_CRITICAL_TOP).index]:
+        room -= len(str(name)) + 2
+        if room < 0: break
+        names.append(str(name))
+    crit_names = ", ".join(names) or ("ninguno" if critical.empty else "")
+    if len(critical) > len(names): crit_names += f" (+{len(critical) - len(names)} más)"
+    head = (f"KPI ventas totales: {to_currency(revenue)} | {top_line}\n"
+            f"Inventario crítico: {crit_names.strip()}\n"
+            f"Docs:\n")
+    docs_text = DOCS_INDEX.retrieve(query, budget - len(head)) if budget > len(head) else ""
+    return (head + (docs_text or "(sin fragmentos relevantes)"))[:budget]
+
+
+_TOKEN_RE = re.compile(r"\w+")
+_COMBINING_RE = re.compile(r"[\u0300-\u036f]")
+_PHRASE_RE = re.compile(r'["“](.+?)["”]')
+
+def fold_text(text: str) -> str:
+    # minúsculas sin acentos ("Política" -> "politica"), conservando la longitud para que
+    # los offsets de los tokens sigan apuntando al texto original
+    folded = _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text)).lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(c if len(c) == 1 else ch.lower()
+                   for ch in text for c in [_COMBINING_RE.sub("", unicodedata.normalize("NFKD", ch)).lower()])
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    return [(m.group(), m.start(), m.end()) for m in _TOKEN_RE.finditer(fold_text(text))]
+
+def parse_query(q: str) -> Tuple[List[str], List[List[str]]]:
+    phrases = [[t for t, _, _ in tokenize(p)] for p in _PHRASE_RE.findall(q)]
+    rest = _PHRASE_RE.sub(" ", q)
+    return [t for t, _, _ in tokenize(rest)], [p for p in phrases if p]
+
+
+class InvertedIndex:
+    # Índice invertido posicional con ranking BM25. Unidades identificadas por id (archivo o fragmento).
+    K1, B = 1.2, 0.75
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, array]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.doc_offsets: Dict[str, array] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_len = 0
+
+    def add(self, doc_id: str, text: str) -> None:
+        toks = tokenize(text)
+        offsets = array("I")
+        for _, a, b in toks: offsets.extend((a, b))
+        self.add_tokens(doc_id, [t for t, _, _ in toks], offsets)
+
+    def add_tokens(self, doc_id: str, terms: List[str], offsets: array) -> None:
+        if doc_id in self.doc_len: self.remove(doc_id)
+        local: Dict[str, List[int]] = {}
+        for pos, term in enumerate(terms):
+            local.setdefault(term, []).append(pos)
+        for term, positions in local.items():
+            self.postings.setdefault(term, {})[doc_id] = array("I", positions)
+        self.doc_len[doc_id] = len(terms)
+        self.doc_offsets[doc_id] = offsets
+        self.doc_terms[doc_id] = list(local)
+        self.total_len += len(terms)
+
+    def remove(self, doc_id: str) -> None:
+        self.doc_offsets.pop(doc_id, None)
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+        for term in self.doc_terms.pop(doc_id, ()):
+            docs = self.postings.get(term)
+            if docs is not None and docs.pop(doc_id, None) is not None and not docs:
+                del self.postings[term]
+
+    def _phrase_positions(self, phrase: List[str]) -> Dict[str, List[int]]:
+        lists = [self.postings.get(t) for t in phrase]
+        if not all(lists): return {}
+        out = {}
+        for doc_id in set.intersection(*(set(l) for l in lists)):
+            rest = [set(l[doc_id]) for l in lists[1:]]
+            hits = [p for p in lists[0][doc_id] if all(p+i+1 in r for i, r in enumerate(rest))]
+            if hits: out[doc_id] = hits
+        return out
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float, Tuple[int, int]]]:
+        terms, phrases = parse_query(query)
+        n_docs = len(self.doc_len)
+        if not n_docs or not (terms or phrases): return []
+        avgdl = self.total_len / n_docs or 1.0
+        scores: Dict[str, float] = {}
+        best: Dict[str, Tuple[float, int, int]] = {}   # doc -> (aporte, posición, largo en tokens)
+
+        def accumulate(matches: Dict[str, Any], width: int) -> None:
+            idf = math.log(1 + (n_docs - len(matches) + 0.5) / (len(matches) + 0.5))
+            for doc_id, positions in matches.items():
+                tf = len(positions)
+                norm = self.K1 * (1 - self.B + self.B * self.doc_len[doc_id] / avgdl)
+                part = idf * tf * (self.K1 + 1) / (tf + norm)
+                scores[doc_id] = scores.get(doc_id, 0.0) + part
+                if part > best.get(doc_id, (-1.0,))[0]:
+                    best[doc_id] = (part, positions[0], width)
+
+        for term in dict.fromkeys(terms):
+            accumulate(self.postings.get(term, {}), 1)
+        if phrases:
+            # las frases entre comillas son obligatorias
+            allowed = None
+            for ph in phrases:
+                matches = self._phrase_positions(ph)
+                accumulate(matches, len(ph))
+                allowed = set(matches) if allowed is None else allowed & set(matches)
+            scores = {d: sc for d, sc in scores.items() if d in allowed}
+        top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+        out = []
+        for doc_id, score in top:
+            _, pos, width = best[doc_id]
+            offs = self.doc_offsets[doc_id]
+            out.append((doc_id, score, (offs[2*pos], offs[2*(pos+width-1)+1])))
+        return out
+
+
+DOCS_WATCH = os.getenv("MCP_DOCS_WATCH", "auto").lower()          # auto|inotify|poll|off
+DOCS_MAX_BYTES = int(float(os.getenv("MCP_DOCS_MAX_MB", "64")) * (1 << 20))
+DOCS_SAVE_SECS = float(os.getenv("MCP_DOCS_SAVE_SECS", "5"))   # los cambios se acumulan y se guardan juntos
+DOCS_LOG = logging.getLogger("mcp.docs")
+_DOC_NAME_RE = re.compile(r"^[\w][\w .()-]{0,127}\.txt$")
+
+
+class DocsError(ValueError):
+    pass
+
+
+class _Inotify:
+    # inotify(7) vía ctypes (solo Linux): eventos de alta/modificación/baja sobre un directorio
+    IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_DELETE = 0x8, 0x40, 0x80, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW = 0x400, 0x800, 0x4000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, path: pathlib.Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1")
+        mask = (self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+                | self.IN_DELETE_SELF | self.IN_MOVE_SELF)
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask) < 0:
+            err = ctypes.get_errno(); os.close(self.fd)
+            raise OSError(err, "inotify_add_watch")
+
+    def read(self, timeout: float) -> Optional[set]:
+        # nombres afectados; None si hay que reescanear todo (cola desbordada o directorio movido)
+        if not select.select([self.fd], [], [], timeout)[0]: return set()
+        names: set = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return names
+            pos = 0
+            while pos < len(buf):
+                _, mask, _, size = self._EVENT.unpack_from(buf, pos)
+                pos += self._EVENT.size
+                if mask & (self.IN_Q_OVERFLOW | self.IN_DELETE_SELF | self.IN_MOVE_SELF): return None
+                names.add(os.fsdecode(buf[pos:pos+size].rstrip(b"\0")))
+                pos += size
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DocsIndex(InvertedIndex):
+    # Índice persistente sobre DOCS_DIR: se actualiza por archivo según (mtime, tamaño) y se
+    # guarda en disco para no reindexar todo el corpus al arrancar cada worker.
+    # Además mantiene un segundo índice de fragmentos (~chunk_chars) para armar el contexto de llm.ask;
+    # los fragmentos se cortan sobre los tokens ya calculados, sin volver a tokenizar.
+    # Un hilo por proceso (inotify o, si no hay, sondeo cada refresh_secs) aplica los cambios del directorio,
+    # así las consultas solo leen memoria. El texto en memoria se limita a max_bytes: lo que no cabe se omite.
+    FORMAT = 1
+
+    def __init__(self, docs_dir: pathlib.Path, path: pathlib.Path, refresh_secs: float = 2.0, chunk_chars: int = 600,
+                 max_bytes: int = DOCS_MAX_BYTES, watch: str = DOCS_WATCH, save_secs: float = DOCS_SAVE_SECS):
+        super().__init__()
+        self.docs_dir, self.path, self.refresh_secs, self.chunk_chars = docs_dir, path, refresh_secs, chunk_chars
+        self.max_bytes, self.watch, self.save_secs = max_bytes, watch, save_secs
+        self._save_timer: Optional[threading.Timer] = None
+        self._save_lock = threading.Lock()
+        self.files: Dict[str, Tuple[int, int]] = {}
+        self.texts: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self.doc_seq: Dict[str, str] = {}
+        self.chunks = InvertedIndex()
+        self.chunk_spans: Dict[str, Tuple[str, int, int]] = {}
+        self.doc_chunks: Dict[str, List[str]] = {}
+        self.version = self._signature()
+        self.nbytes = 0
+        self.skipped: Dict[str, int] = {}
+        self.watcher: Optional[str] = None
+        self._watch_pid = 0
+        self._load()
+
+    def add_tokens(self, doc_id: str, terms: List[str], offsets: array) -> None:
+        super().add_tokens(doc_id, terms, offsets)
+        self.doc_seq[doc_id] = " ".join(terms)
+        ids, start, n = [], 0, len(terms)
+        while start < n:
+            end = start + 1
+            while end < n and offsets[2*end+1] - offsets[2*start] <= self.chunk_chars:
+                end += 1
+            cid = f"{doc_id}#{len(ids)}"
+            self.chunks.add_tokens(cid, terms[start:end], offsets[2*start:2*end])
+            self.chunk_spans[cid] = (doc_id, offsets[2*start], offsets[2*end-1])
+            ids.append(cid)
+            start = end
+        self.doc_chunks[doc_id] = ids
+
+    def remove(self, doc_id: str) -> None:
+        super().remove(doc_id)
+        self.doc_seq.pop(doc_id, None)
+        for cid in self.doc_chunks.pop(doc_id, ()):
+            self.chunks.remove(cid)
+            self.chunk_spans.pop(cid, None)
+
+    def _load(self) -> None:
+        # se persisten los tokens de cada documento (no las postings): guardar es barato y
+        # reconstruir las postings al arrancar evita volver a tokenizar el corpus
         try:
-            chunks.append(pathlib.Path(path).read_text(encoding="utf-8"))
-        except:
+            with open(self.path, "rb") as fh:
+                state = pickle.load(fh)
+            if state.get("format") != self.FORMAT: return
+            for name, (terms, offsets) in state["tokens"].items():
+                self.add_tokens(name, terms.split(" ") if terms else [], offsets)
+            self.files, self.texts = state["files"], state["texts"]
+            self.nbytes = sum(size for _, size in self.files.values())
+            self.version = state.get("version") or self._signature()
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, ValueError):
             pass
-    return "\n\n".join(chunks)
-
-
-def minimal_pdf(title: str, lines: List[str]) -> bytes:
-    body = f"BT /F1 16 Tf 72 770 Td ({title}) Tj ET\n"
-    y = 740
-    for ln in lines[:40]:
-        safe = ln.replace("(", "[").replace(")", "]")
-        body += f"BT /F1 10 Tf 72 {y} Td ({safe}) Tj ET\n"
-        y -= 14
-        if y < 50: break
-    stream = body.encode("latin-1","ignore")
-    objs = []
-    objs.append(b"1 0 obj<< /Type /Catalog /Pages 2 0 R >>endobj\n")
-    objs.append(b"2 0 obj<< /Type /Pages /Count 1 /Kids [3 0 R] >>endobj\n")
-    objs.append(b"3 0 obj<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>endobj\n")
-    objs.append(b"4 0 obj<< /Length " + str(len(stream)).encode() + b" >>stream\n" + stream + b"\nendstream endobj\n")
-    objs.append(b"5 0 obj<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>endobj\n")
-    output = io.BytesIO()
-    output.write(b"%PDF-1.4\n")
-    offsets=[0]
-    for o in objs:
-        offsets.append(output.tell())
-        output.write(o)
-    xref_start = output.tell()
-    output.write(f"xref\n0 {len(objs)+1}\n".encode())
-    output.write(b"0000000000 65535 f \n")
-    for off in offsets[1:]:
-        output.write(f"{off:010} 00000 n \n".encode())
-    output.write(b"trailer<< /Size " + str(len(objs)+1).encode() + b" /Root 1 0 R >>\n")
-    output.write(f"startxref\n{xref_start}\n%%EOF".encode())
-    output.seek(0)
-    return output.read()
-
-def save_file(name: str, data: bytes) -> str:
-    p = FILES_DIR / name
-    p.write_bytes(data)
-    return str(p.name)
 
+    def _signature(self) -> str:
+        # versión derivada del contenido (firmas mtime/tamaño), estable entre reinicios y entre workers
+        return hashlib.sha1(repr(sorted(self.files.items())).encode()).hexdigest()[:16]
 
-def tool_sales_summary(args: Dict[str, Any]) -> Dict[str, Any]:
-    df = load_sales()
+    def _schedule_save(self) -> None:
+        # con el lock tomado: un solo guardado pendiente agrupa todos los cambios de los próximos save_secs
+        if self.save_secs <= 0: return self._save()
+        if self._save_timer is not None: return
+        self._save_timer = threading.Timer(self.save_secs, self._save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self) -> None:
+        # guarda ya lo pendiente (al salir del proceso)
+        timer = self._save_timer
+        if timer is not None:
+            timer.cancel()
+            self._save()
+
+    def _save(self) -> None:
+        # copia superficial bajo el lock; el pickle (lo caro) se hace fuera para no bloquear consultas
+        with self._lock:
+            self._save_timer = None
+            tokens = {name: (self.doc_seq[name], self.doc_offsets[name]) for name in self.doc_len}
+            state = {"format": self.FORMAT, "files": dict(self.files), "texts": dict(self.texts),
+                     "tokens": tokens, "version": self.version}
+        with self._save_lock:
+            tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                with open(tmp, "wb") as fh:
+                    pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self.path)
+            except OSError:
+                DOCS_LOG.exception("no se pudo guardar el índice de documentos")
+                with contextlib.suppress(OSError): tmp.unlink()
+
+    @staticmethod
+    def _indexable(name: str) -> bool:
+        return name.endswith(".txt") and not name.startswith(".")
+
+    def _put(self, name: str, text: str, sig: Tuple[int, int]) -> bool:
+        # con el lock tomado; False si el documento no cabe en el presupuesto de memoria
+        old = self.files.get(name, (0, 0))[1]
+        if self.nbytes - old + sig[1] > self.max_bytes:
+            if name not in self.skipped: DOCS_LOG.warning("documento %s omitido: supera MCP_DOCS_MAX_MB", name)
+            self.skipped[name] = sig[1]
+            return False
+        self.add(name, text)
+        self.texts[name], self.files[name] = text, sig
+        self.nbytes += sig[1] - old
+        self.skipped.pop(name, None)
+        return True
+
+    def _drop(self, name: str) -> bool:
+        self.skipped.pop(name, None)
+        if name not in self.files: return False
+        self.remove(name); self.texts.pop(name, None)
+        self.nbytes -= self.files.pop(name)[1]
+        return True
+
+    def apply(self, names) -> int:
+        # actualización incremental de los archivos indicados; devuelve cuántos cambiaron.
+        # Se leen fuera del lock: las búsquedas solo esperan la actualización del índice.
+        found: Dict[str, Optional[Tuple[Tuple[int, int], Optional[str]]]] = {}
+        for name in names:
+            if not self._indexable(name): continue
+            try:
+                st = os.stat(self.docs_dir / name)
+            except OSError:
+                found[name] = None; continue
+            sig = (st.st_mtime_ns, st.st_size)
+            if self.files.get(name) == sig or self.skipped.get(name) == sig[1]: continue
+            try:
+                found[name] = (sig, (self.docs_dir / name).read_text(encoding="utf-8", errors="ignore"))
+            except OSError:
+                continue
+        changed = 0
+        with self._lock:
+            for name, item in found.items():
+                changed += self._drop(name) if item is None else self._put(name, item[1], item[0])
+            if changed:
+                self.version = self._signature()
+                self._schedule_save()
+        return changed
+
+    def refresh(self) -> int:
+        # reescaneo completo del directorio (arranque, sondeo o cola de inotify desbordada)
+        try:
+            current = {e.name for e in os.scandir(self.docs_dir) if self._indexable(e.name) and e.is_file()}
+        except FileNotFoundError:
+            return 0   # directorio movido o borrado: se conserva el índice hasta que vuelva
+        return self.apply(current | set(self.files) | set(self.skipped))
+
+    def ingest(self, docs: Dict[str, str], delete: List[str] = ()) -> Dict[str, Any]:
+        # Alta/modificación/baja explícita: se escriben los archivos (atómicamente) y se indexan en el acto,
+        # sin esperar al watcher; cuando llega su evento la firma ya coincide y no se relee nada.
+        for name in list(docs) + list(delete):
+            if not _DOC_NAME_RE.match(name): raise DocsError(f"nombre de documento inválido: {name!r}")
+        data = {name: text.encode("utf-8") for name, text in docs.items()}
+        with self._lock:
+            freed = sum(self.files.get(n, (0, 0))[1] for n in set(data) | set(delete))
+            if self.nbytes - freed + sum(len(b) for b in data.values()) > self.max_bytes:
+                raise DocsError(f"el corpus superaría el límite de {self.max_bytes >> 20} MB")
+            out = {"added": [], "updated": [], "deleted": []}
+            for name in delete:
+                with contextlib.suppress(FileNotFoundError): (self.docs_dir / name).unlink()
+                if self._drop(name): out["deleted"].append(name)
+            for name, raw in data.items():
+                final = self.docs_dir / name
+                tmp = final.with_name(f".{name}.{uuid.uuid4().hex}.tmp")
+                tmp.write_bytes(raw)
+                os.replace(tmp, final)
+                st = final.stat()
+                out["updated" if name in self.files else "added"].append(name)
+                self._put(name, docs[name], (st.st_mtime_ns, st.st_size))
+            if any(out.values()):
+                self.version = self._signature()
+                self._schedule_save()
+            return dict(out, docs=len(self.files), bytes=self.nbytes, version=self.version)
+
+    def ensure_watching(self) -> None:
+        # un hilo por proceso, creado en el primer uso (los workers de gunicorn lo arrancan tras el fork)
+        if self._watch_pid == os.getpid(): return
+        with self._lock:
+            if self._watch_pid == os.getpid(): return
+            self._watch_pid = os.getpid()
+            self.refresh()
+            if self.watch == "off": return
+            notify = None
+            if self.watch in ("auto", "inotify"):
+                try:
+                    notify = _Inotify(self.docs_dir)
+                except (OSError, AttributeError) as e:   # sin inotify (macOS/Windows, límite de watches)
+                    DOCS_LOG.info("inotify no disponible (%s); se sondea cada %ss", e, self.refresh_secs)
+            self.watcher = "inotify" if notify else "poll"
+            threading.Thread(target=self._watch, args=(notify,), name="docs-watcher", daemon=True).start()
+
+    def _watch(self, notify: Optional[_Inotify]) -> None:
+        while True:
+            try:
+                if notify is None:
+                    time.sleep(self.refresh_secs); self.refresh()
+                    continue
+                names = notify.read(timeout=60.0)   # cada minuto, reescaneo de seguridad
+                deadline = time.monotonic() + 1.0
+                while names and time.monotonic() < deadline:
+                    # ráfagas (copias masivas, editores): se agrupan para indexar y guardar una sola vez
+                    more = notify.read(timeout=0.05)
+                    if more is None: names = None
+                    if not more: break
+                    names |= more
+                if names is None:
+                    # cola desbordada o directorio movido/borrado: se vuelve a vigilar la ruta (o se pasa a sondeo)
+                    notify.close()
+                    try:
+                        notify = _Inotify(self.docs_dir)
+                    except OSError:
+                        notify, self.watcher = None, "poll"
+                if not names: self.refresh()
+                else: self.apply(names)
+            except Exception:
+                DOCS_LOG.exception("error actualizando el índice de documentos")
+                time.sleep(self.refresh_secs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"docs": len(self.files), "bytes": self.nbytes, "max_bytes": self.max_bytes,
+                    "skipped": sorted(self.skipped), "version": self.version, "watcher": self.watcher}
+
+    def search_docs(self, query: str, k: int = 10, snippet_chars: int = 60) -> List[Dict[str, Any]]:
+        self.ensure_watching()
+        with self._lock:
+            hits = self.search(query, k)
+            out = []
+            for name, score, (a, b) in hits:
+                text = self.texts.get(name, "")
+                lo, hi = max(0, a - snippet_chars), min(len(text), b + snippet_chars)
+                snippet = ("…" if lo > 0 else "") + text[lo:hi].replace("\n", " ") + ("…" if hi < len(text) else "")
+                out.append({"doc": name, "score": round(score, 4), "start": a, "end": b, "snippet": snippet})
+            return out
+
+    def retrieve(self, query: str, budget_chars: int) -> str:
+        # fragmentos BM25 más relevantes, en orden, hasta agotar el presupuesto de caracteres
+        self.ensure_watching()
+        with self._lock:
+            parts, used = [], 0
+            for cid, _, _ in self.chunks.search(query, k=32):
+                doc, a, b = self.chunk_spans[cid]
+                piece = f"[{doc}] " + " ".join(self.texts.get(doc, "")[a:b].split())
+                if used + len(piece) > budget_chars:
+                    if not parts and budget_chars > 0: parts.append(piece[:budget_chars])
+                    break
+                parts.append(piece); used += len(piece) + 1
+            return "\n".join(parts)
+
+DOCS_INDEX = DocsIndex(DOCS_DIR, DATA_DIR / ".docs_index.pkl", float(os.getenv("DOCS_REFRESH_SECS", "2")),
+                       int(os.getenv("DOCS_CHUNK_CHARS", "600")))
+atexit.register(DOCS_INDEX.flush)
+
+
+class LRUCache:
+    # LRU con límite de entradas y, opcionalmente, de tamaño total (bytes aproximados)
+    def __init__(self, max_entries: int = 256, max_bytes: int = 0):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self._data: "OrderedDict[Any, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key: Any, value: Any, size: int = 0) -> None:
+        with self._lock:
+            if self.max_bytes and size > self.max_bytes: return
+            if key in self._data: self.bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self.bytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self.bytes, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+LLM_CONTEXT_CHARS = int(os.getenv("LLM_CONTEXT_CHARS", "2000"))
+CONTEXT_CACHE = LRUCache(int(os.getenv("LLM_CONTEXT_CACHE", "256")), int(os.getenv("LLM_CONTEXT_CACHE_BYTES", str(8 << 20))))
+RESULT_CACHE = LRUCache(int(os.getenv("RESULT_CACHE_ENTRIES", "1024")), int(os.getenv("RESULT_CACHE_BYTES", str(64 << 20))))
+
+
+# ---------- Métricas por herramienta ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOW_CALL_MS = float(os.getenv("MCP_SLOW_CALL_MS", "1000"))
+PROFILE_SAMPLE = float(os.getenv("MCP_PROFILE_SAMPLE", "0.05"))   # fracción de llamadas perfiladas
+PROFILE_MODE = os.getenv("MCP_PROFILE", "cprofile").lower()       # cprofile | tracemalloc | off
+SLOW_LOG = logging.getLogger("mcp.slow")
+
+# tiempos por fase (load/compute/serialize) de la llamada en curso
+_PHASES: contextvars.ContextVar = contextvars.ContextVar("mcp_phases", default=None)
+
+@contextlib.contextmanager
+def timed_phase(phase: str):
+    phases = _PHASES.get()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - t0
+
+
+class _ToolStats:
+    __slots__ = ("outcomes", "buckets", "sum", "count", "phases", "slow")
+    def __init__(self, n_buckets: int):
+        self.outcomes: Dict[str, int] = {}
+        self.buckets, self.sum, self.count = [0] * n_buckets, 0.0, 0
+        self.phases: Dict[str, float] = {}
+        self.slow = 0
+
+
+class ToolMetrics:
+    # Contadores e histogramas en memoria (por proceso: con varios workers de gunicorn cada uno expone los suyos)
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, keep_slow: int = 50):
+        self.bucket_bounds = buckets
+        self._lock = threading.Lock()
+        self._tools: Dict[str, _ToolStats] = {}
+        self.recent_slow: deque = deque(maxlen=keep_slow)
+        self._profiling = threading.Lock()
+
+    def observe(self, tool: str, seconds: float, outcome: str, phases: Optional[Dict[str, float]] = None) -> None:
+        with self._lock:
+            st = self._tools.get(tool)
+            if st is None:
+                st = self._tools[tool] = _ToolStats(len(self.bucket_bounds))
+            st.outcomes[outcome] = st.outcomes.get(outcome, 0) + 1
+            st.sum += seconds; st.count += 1
+            for i, b in enumerate(self.bucket_bounds):
+                if seconds <= b:
+                    st.buckets[i] += 1; break
+            for ph, v in (phases or {}).items():
+                st.phases[ph] = st.phases.get(ph, 0.0) + v
+
+    def add_phase(self, tool: str, phase: str, seconds: float) -> None:
+        with self._lock:
+            st = self._tools.get(tool)
+            if st is not None:
+                st.phases[phase] = st.phases.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def profile(self):
+        # perfila una muestra de las llamadas, de a una por vez (tracemalloc es global al proceso)
+        out: Dict[str, Any] = {}
+        if PROFILE_MODE == "off" or random.random() >= PROFILE_SAMPLE or not self._profiling.acquire(blocking=False):
+            yield out; return
+        try:
+            if PROFILE_MODE == "tracemalloc":
+                tracemalloc.start()
+                try:
+                    yield out
+                    snap = tracemalloc.take_snapshot()
+                    out["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                    out["top"] = [str(s) for s in snap.statistics("lineno")[:10]]
+                finally:
+                    tracemalloc.stop()
+            else:
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    yield out
+                finally:
+                    prof.disable()
+                buf = io.StringIO()
+                pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(15)
+                out["cprofile"] = buf.getvalue()
+        finally:
+            self._profiling.release()
+
+    def slow_call(self, tool: str, seconds: float, args: Dict[str, Any], phases: Dict[str, float], profile: Dict[str, Any]) -> None:
+        rec = {"time": datetime.now().isoformat(), "tool": tool, "ms": round(seconds * 1000, 1),
+               "arguments": {k: (v[:200] + "…" if isinstance(v, str) and len(v) > 200 else v) for k, v in args.items()},
+               "phases_ms": {k: round(v * 1000, 1) for k, v in phases.items()}}
+        if profile: rec["profile"] = profile
+        with self._lock:
+            st = self._tools.get(tool)
+            if st is not None: st.slow += 1
+            self.recent_slow.append(rec)
+        SLOW_LOG.warning("llamada lenta %s", json.dumps(rec, ensure_ascii=False, default=str))
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: {"outcomes": dict(v.outcomes), "buckets": list(v.buckets), "sum": v.sum, "count": v.count,
+                        "phases": dict(v.phases), "slow": v.slow} for k, v in self._tools.items()}
+
+METRICS = ToolMetrics()
+
+
+def _prom_labels(**labels: Any) -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    def metric(name: str, kind: str, help_: str, samples: List[Tuple[str, Any]]) -> None:
+        lines.extend([f"# HELP {name} {help_}", f"# TYPE {name} {kind}"])
+        lines.extend(f"{name}{lbl} {val}" for lbl, val in samples)
+    tools = METRICS.snapshot()
+    metric("mcp_tool_calls_total", "counter", "Llamadas por herramienta y resultado",
+           [(_prom_labels(tool=t, outcome=o), n) for t, st in tools.items() for o, n in sorted(st["outcomes"].items())])
+    hist = []
+    for t, st in tools.items():
+        acc = 0
+        for b, n in zip(METRICS.bucket_bounds, st["buckets"]):
+            acc += n
+            hist.append((_prom_labels(tool=t, le=b), acc))
+        hist.append((_prom_labels(tool=t, le="+Inf"), st["count"]))
+    lines.extend(["# HELP mcp_tool_latency_seconds Latencia de las herramientas", "# TYPE mcp_tool_latency_seconds histogram"])
+    lines.extend(f"mcp_tool_latency_seconds_bucket{lbl} {v}" for lbl, v in hist)
+    for t, st in tools.items():
+        lines.append(f"mcp_tool_latency_seconds_sum{_prom_labels(tool=t)} {st['sum']:.6f}")
+        lines.append(f"mcp_tool_latency_seconds_count{_prom_labels(tool=t)} {st['count']}")
+    metric("mcp_tool_phase_seconds_total", "counter", "Tiempo por fase (load=carga de datos, compute, serialize)",
+           [(_prom_labels(tool=t, phase=p), f"{v:.6f}") for t, st in tools.items() for p, v in sorted(st["phases"].items())])
+    metric("mcp_tool_slow_calls_total", "counter", f"Llamadas por encima de {SLOW_CALL_MS:g} ms",
+           [(_prom_labels(tool=t), st["slow"]) for t, st in tools.items()])
+    caches = {"result": RESULT_CACHE.stats(), "context": CONTEXT_CACHE.stats()}
+    data = DATA_CACHE.snapshot_stats()
+    caches["data"] = {"entries": data["entries"], "hits": data["hits"], "misses": data["misses"] + data["reloads"]}
+    metric("mcp_cache_hits_total", "counter", "Aciertos de caché", [(_prom_labels(cache=c), st["hits"]) for c, st in caches.items()])
+    metric("mcp_cache_misses_total", "counter", "Fallos de caché", [(_prom_labels(cache=c), st["misses"]) for c, st in caches.items()])
+    metric("mcp_cache_hit_ratio", "gauge", "Tasa de aciertos de caché",
+           [(_prom_labels(cache=c), round(st["hits"] / (st["hits"] + st["misses"]), 6) if st["hits"] + st["misses"] else 0)
+            for c, st in caches.items()])
+    metric("mcp_cache_entries", "gauge", "Entradas en caché", [(_prom_labels(cache=c), st["entries"]) for c, st in caches.items()])
+    metric("mcp_cache_bytes", "gauge", "Tamaño aproximado de la caché", [(_prom_labels(cache=c), caches[c]["bytes"]) for c in ("result", "context")])
+    metric("mcp_cache_evictions_total", "counter", "Expulsiones por LRU", [(_prom_labels(cache=c), caches[c]["evictions"]) for c in ("result", "context")])
+    metric("mcp_data_cache_reloads_total", "counter", "Recargas por cambio de versión del dataset", [("", data["reloads"])])
+    metric("mcp_data_cache_column_loads_total", "counter", "Columnas cargadas desde el store", [("", data["column_loads"])])
+    return "\n".join(lines) + "\n"
+
+
+_PDF_ESCAPES = {ord("\\"): "\\\\", ord("("): "\\(", ord(")"): "\\)", ord("\r"): " ", ord("\n"): " ", ord("\t"): " ", ord("→"): "->"}
+
+def pdf_text(text: Any) -> bytes:
+    # cadena literal PDF: escapa \\ ( ) y codifica en WinAnsi (cp1252); lo no representable queda como '?'
+    return str(text).translate(_PDF_ESCAPES).encode("cp1252", "replace")
+
+
+class PdfWriter:
+    # Escritor PDF incremental sobre un file handle: cada página se escribe (opcionalmente comprimida
+    # con Flate) apenas se llena, así que la memoria usada es la de una página y la tabla xref.
+    # Objetos fijos: 1 catálogo, 2 árbol de páginas, 3/4 fuentes Helvetica y Helvetica-Bold.
+    PAGE_W, PAGE_H, MARGIN = 595, 842, 50
+
+    def __init__(self, fh, title: str, compress: bool = True, font_size: float = 9, leading: float = 12):
+        self.fh, self.title, self.compress = fh, title, compress
+        self.font_size, self.leading = font_size, leading
+        self.offsets: Dict[int, int] = {}
+        self.page_ids: List[int] = []
+        self.next_id = 5
+        self._ops: List[bytes] = []
+        self._y = 0.0
+        self._table: Optional[Tuple[List[str], List[float]]] = None
+        self.fh.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _pos(self) -> int:
+        return self.fh.tell()
+
+    def _obj(self, obj_id: int, body: bytes) -> None:
+        self.offsets[obj_id] = self._pos()
+        self.fh.write(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _alloc(self) -> int:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _put(self, x: float, y: float, text: Any, bold: bool = False, size: Optional[float] = None) -> None:
+        self._ops.append(b"/F%d %.1f Tf 1 0 0 1 %.1f %.1f Tm (" % (2 if bold else 1, size or self.font_size, x, y)
+                         + pdf_text(text) + b") Tj\n")
+
+    def _start_page(self) -> None:
+        self._ops = [b"BT\n"]
+        self._put(self.MARGIN, self.PAGE_H - self.MARGIN, self.title, bold=True, size=14)
+        self._put(self.PAGE_W - self.MARGIN - 60, self.MARGIN - 20, f"Página {len(self.page_ids) + 1}", size=8)
+        self._y = self.PAGE_H - self.MARGIN - 28
+        if self._table: self._table_header()
+
+    def _flush_page(self) -> None:
+        if not self._ops: return
+        self._ops.append(b"ET")
+        content = b"".join(self._ops)
+        self._ops = []
+        extra = b""
+        if self.compress:
+            content, extra = zlib.compress(content, 6), b" /Filter /FlateDecode"
+        stream_id, page_id = self._alloc(), self._alloc()
+        self._obj(stream_id, b"<< /Length %d%s >>\nstream\n" % (len(content), extra) + content + b"\nendstream")
+        self._obj(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                           b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % (self.PAGE_W, self.PAGE_H, stream_id))
+        self.page_ids.append(page_id)
+
+    def _ensure_room(self) -> None:
+        if not self._ops:
+            self._start_page()
+        elif self._y < self.MARGIN:
+            self._flush_page(); self._start_page()
+
+    def _max_chars(self, width: float, size: Optional[float] = None) -> int:
+        # Helvetica: ~0.5 em de ancho medio por carácter
+        return max(1, int(width / ((size or self.font_size) * 0.5)))
+
+    def text(self, text: str, bold: bool = False) -> None:
+        width = self._max_chars(self.PAGE_W - 2 * self.MARGIN)
+        for raw in str(text).split("\n") or [""]:
+            for i in range(0, max(len(raw), 1), width):
+                self._ensure_room()
+                self._put(self.MARGIN, self._y, raw[i:i+width], bold=bold)
+                self._y -= self.leading
+
+    def _table_header(self) -> None:
+        headers, xs = self._table
+        for h, x in zip(headers, xs): self._put(x, self._y, h, bold=True)
+        self._y -= self.leading
+
+    def table(self, headers: List[str], rows, widths: Optional[List[float]] = None) -> None:
+        # 'rows' puede ser cualquier iterable (p.ej. un generador por bloques); el encabezado se repite por página
+        usable = self.PAGE_W - 2 * self.MARGIN
+        widths = widths or [1.0] * len(headers)
+        total = float(sum(widths))
+        xs, x = [], float(self.MARGIN)
+        for w in widths:
+            xs.append(x); x += usable * w / total
+        limits = [self._max_chars(usable * w / total - 4) for w in widths]
+        self._table = (headers, xs)
+        if self._ops: self._table_header()
+        for row in rows:
+            self._ensure_room()
+            for cell, x, lim in zip(row, xs, limits):
+                cell = str(cell)
+                self._put(x, self._y, cell if len(cell) <= lim else cell[:lim-1] + "…")
+            self._y -= self.leading
+        self._table = None
+        self._y -= self.leading / 2
+
+    def close(self) -> None:
+        if not self._ops and not self.page_ids: self._start_page()
+        self._flush_page()
+        kids = b" ".join(b"%d 0 R" % i for i in self.page_ids)
+        self._obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._obj(2, b"<< /Type /Pages /Count %d /Kids [%s] >>" % (len(self.page_ids), kids))
+        for obj_id, font in ((3, b"Helvetica"), (4, b"Helvetica-Bold")):
+            self._obj(obj_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /" + font + b" /Encoding /WinAnsiEncoding >>")
+        xref_start = self._pos()
+        size = self.next_id
+        out = [f"xref\n0 {size}\n".encode(), b"0000000000 65535 f \n"]
+        out += [f"{self.offsets.get(i, 0):010} 00000 n \n".encode() for i in range(1, size)]
+        out.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_start}\n%%EOF\n".encode())
+        self.fh.write(b"".join(out))
+
+
+def stream_sales_summary(args: Dict[str, Any]):
     month = args.get("month")
-    if month:
-        df = df[df["month"].str.lower()==str(month).lower()]
-    df = df.assign(revenue=df["units"]*df["unit_price"])
-    total = to_currency(df["revenue"].sum())
-    by_prod = df.groupby("product")["revenue"].sum().sort_values(ascending=False)
-    lines = [f"RESUMEN DE VENTAS ({month or 'todos'})",
-             f"Ingreso total: {total}",
-             "Por producto:"]
-    for prod, rev in by_prod.items():
-        lines.append(f" - {prod}: {to_currency(rev)}")
-    return tool_result("\n".join(lines))
+    revenue, by_prod = load_sales_aggregates().month_totals(month)
+    yield text_piece(f"RESUMEN DE VENTAS ({month or 'todos'})\nIngreso total: {to_currency(revenue)}\nPor producto:")
+    yield from stream_lines(f" - {prod}: {to_currency(rev)}" for prod, rev in by_prod.items())
+
+def tool_sales_summary(args: Dict[str, Any]) -> Dict[str, Any]:
+    return collect_stream(stream_sales_summary(args))
+
+TIMESERIES_FREQS = {"D": "día", "W": "semana", "M": "mes"}
+TIMESERIES_MAX_PERIODS = int(os.getenv("TIMESERIES_MAX_PERIODS", "5000"))
+_NS_PER_DAY = 86_400_000_000_000
+
+def parse_period_bound(value: Any, end: bool = False) -> Optional[np.datetime64]:
+    # "2024", "2024-08" o "2024-08-15"; el fin es inclusivo en su propia resolución (2024-08 = todo agosto)
+    if value in (None, ""): return None
+    d = np.datetime64(str(value).strip())
+    return d + 1 if end else d
+
+def period_keys(ns: np.ndarray, freq: str) -> np.ndarray:
+    days = ns // _NS_PER_DAY
+    if freq == "D": return days
+    if freq == "W": return days - (days + 3) % 7            # lunes de la semana (1970-01-01 fue jueves)
+    return ns.view("datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+
+def period_label(key: int, freq: str) -> str:
+    if freq == "M": return str(np.datetime64(int(key), "M"))
+    return str(np.datetime64(int(key), "D"))
+
+def sales_rollup(args: Dict[str, Any]) -> Dict[str, Any]:
+    # Una sola pasada vectorizada sobre el rango: claves de periodo + bincount (periodos sin ventas = 0),
+    # luego variación contra el periodo anterior y media móvil con suma acumulada.
+    freq = str(args.get("freq") or "M").upper()[:1]
+    if freq not in TIMESERIES_FREQS: raise ValueError("freq debe ser D, W o M")
+    metric = "units" if str(args.get("metric") or "").lower() == "units" else "revenue"
+    window = max(1, int(args.get("window", 3)))
+    start, end = parse_period_bound(args.get("start")), parse_period_bound(args.get("end"), end=True)
+    idx = load_time_index()
+    lo, hi = idx.span(start, end)
+    sales = load_sales(["units","unit_price"] + (["product"] if args.get("product") else []))
+    dates = idx.dates[lo:hi]
+    units = idx.take(sales["units"].to_numpy(), lo, hi)
+    revenue = units * idx.take(sales["unit_price"].to_numpy(), lo, hi)
+    if args.get("product"):
+        products = sales["product"]
+        codes = idx.take(products.cat.codes.to_numpy(), lo, hi)
+        mask = filter_products(pd.Series(pd.Categorical.from_codes(codes, categories=products.cat.categories)), args["product"])
+        dates, units, revenue = dates[mask], units[mask], revenue[mask]
+    out = {"freq": freq, "metric": metric, "window": window, "rows": int(len(dates)),
+           "start": None if start is None else str(start), "end": None if end is None else str(end - 1), "periods": []}
+    if not len(dates): return out
+    keys = period_keys(dates, freq)
+    step = 7 if freq == "W" else 1
+    first = int(keys[0])
+    slot = (keys - first) // step
+    n = int(slot[-1]) + 1
+    if n > TIMESERIES_MAX_PERIODS:
+        raise ValueError(f"demasiados periodos ({n}); usar una frecuencia mayor o acotar start/end")
+    u = np.bincount(slot, weights=units, minlength=n)
+    r = np.bincount(slot, weights=revenue, minlength=n)
+    series = u if metric == "units" else r
+    delta = np.full(n, np.nan); delta[1:] = series[1:] - series[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(np.r_[np.nan, series[:-1]] != 0, delta / np.r_[np.nan, series[:-1]], np.nan)
+    ma = np.full(n, np.nan)
+    if n >= window:
+        c = np.cumsum(np.r_[0.0, series])
+        ma[window-1:] = (c[window:] - c[:-window]) / window
+    num = lambda x: None if np.isnan(x) else round(float(x), 4)
+    out["periods"] = [{"period": period_label(first + i * step, freq), "units": int(u[i]), "revenue": round(float(r[i]), 2),
+                       "delta": num(delta[i]), "delta_pct": num(pct[i]), "moving_avg": num(ma[i])} for i in range(n)]
+    return out
+
+def stream_sales_timeseries(args: Dict[str, Any]):
+    try:
+        ts = sales_rollup(args)
+    except ValueError as e:
+        yield text_piece(f"Parámetros inválidos: {e}")
+        return {"isError": True}
+    fmt = (lambda v: to_currency(v)) if ts["metric"] == "revenue" else (lambda v: f"{v:,.0f}")
+    yield text_piece(f"SERIE DE VENTAS por {TIMESERIES_FREQS[ts['freq']]} ({ts['start'] or 'inicio'} → {ts['end'] or 'fin'}), "
+                     f"{ts['metric']}, media móvil {ts['window']}:")
+    if not ts["periods"]:
+        yield text_piece(" Sin ventas en el rango.")
+    def line(p):
+        val = p["units"] if ts["metric"] == "units" else p["revenue"]
+        delta = "" if p["delta"] is None else f" | Δ {'+' if p['delta'] >= 0 else '-'}{fmt(abs(p['delta']))}"
+        if p["delta_pct"] is not None: delta += f" ({p['delta_pct']:+.1%})"
+        ma = "" if p["moving_avg"] is None else f" | MM{ts['window']} {fmt(p['moving_avg'])}"
+        return f" - {p['period']}: {fmt(val)}{delta}{ma}"
+    yield from stream_lines(line(p) for p in ts["periods"])
+    return {"structuredContent": ts}
+
+def tool_sales_timeseries(args: Dict[str, Any]) -> Dict[str, Any]:
+    return collect_stream(stream_sales_timeseries(args))
 
 def tool_sales_top(args: Dict[str, Any]) -> Dict[str, Any]:
-    df = load_sales().assign(revenue=lambda x: x["units"]*x["unit_price"])
     metric = (args.get("by") or "revenue").lower()
     n = int(args.get("n", 5))
     if metric not in ("revenue","units"): metric="revenue"
     key = "revenue" if metric=="revenue" else "units"
-    agg = df.groupby("product")[key].sum().sort_values(ascending=False).head(n)
+    aggs = DATA_CACHE.peek_derived(sales_store(), "aggregates")
+    if aggs is None and key == "units":
+        # sin agregados aún: por unidades basta con month/product/units (no se lee unit_price)
+        aggs = DATA_CACHE.derived(sales_store(), "units_aggregates",
+                                  SalesAggregates.from_sales, ["month","product","units"])
+    agg = (aggs if aggs is not None else load_sales_aggregates()).top(n, key)
     lines=[f"TOP {n} productos por {metric}:"]
     for prod, val in agg.items():
         lines.append(f" - {prod}: {to_currency(val) if metric=='revenue' else int(val)}")
     return tool_result("\n".join(lines))
 
+INVENTORY_PAGE_LIMIT = int(os.getenv("INVENTORY_PAGE_LIMIT", "200"))
+
+def _flag(v: Any) -> bool:
+    return str(v).strip().lower() in ("1", "true", "yes", "si", "sí") if not isinstance(v, bool) else v
+
+def filter_products(products: pd.Series, prefix: Optional[str]) -> np.ndarray:
+    # el prefijo se evalúa sobre las categorías (pocas) y se proyecta a las filas por código
+    if not prefix: return np.ones(len(products), dtype=bool)
+    if isinstance(products.dtype, pd.CategoricalDtype):
+        ok = np.append(products.cat.categories.astype(str).str.lower().str.startswith(str(prefix).lower()), False)
+        return ok[products.cat.codes.to_numpy()]
+    return products.astype(str).str.lower().str.startswith(str(prefix).lower()).to_numpy()
+
+def page_rows(df: pd.DataFrame, args: Dict[str, Any], score: str, default_sort: Optional[str] = None) -> Tuple[pd.DataFrame, int, int, int]:
+    # top_k por 'score' (selección parcial), luego sort opcional ("campo" o "-campo") y offset/limit
+    top_k = args.get("top_k")
+    if top_k is not None and int(top_k) < len(df):
+        k = max(0, int(top_k))
+        vals = df[score].to_numpy()
+        idx = np.argpartition(-vals, k-1)[:k] if k else np.array([], dtype=int)
+        df = df.iloc[idx[np.argsort(-vals[idx], kind="stable")]]
+    sort = args.get("sort") or default_sort
+    if sort:
+        col = sort.lstrip("-")
+        if col in df.columns:
+            key = (lambda c: c.astype(str)) if isinstance(df[col].dtype, pd.CategoricalDtype) else None
+            df = df.sort_values(col, ascending=not sort.startswith("-"), kind="stable", key=key)
+    offset = max(0, int(args.get("offset", 0)))
+    limit = max(0, int(args.get("limit", INVENTORY_PAGE_LIMIT)))
+    page = df.iloc[offset:offset+limit]
+    # los nombres se materializan como texto solo para la página devuelta
+    return page.assign(product=page["product"].astype(str)), len(df), offset, limit
+
+def page_footer(shown: int, matched: int, offset: int) -> List[str]:
+    if shown >= matched: return []
+    return [f" ... mostrando {offset+1}-{offset+shown} de {matched} (usar offset/limit)"]
+
+def stream_page(page: pd.DataFrame, fmt) -> Any:
+    # formatea la página por bloques: no se arma el texto completo en memoria
+    for i in range(0, len(page), STREAM_CHUNK_LINES):
+        yield text_piece("\n".join(fmt(page.iloc[i:i+STREAM_CHUNK_LINES]).tolist()))
+
+def stream_args(args: Dict[str, Any], streaming: bool, total: int) -> Dict[str, Any]:
+    # en streaming no hace falta paginar: sin 'limit' explícito se emiten todas las filas
+    return dict(args, limit=total) if streaming and args.get("limit") is None else args
+
+def stream_inventory_status(args: Dict[str, Any], streaming: bool = True):
+    inv = load_inventory(["product","stock","min_required"])
+    stock, mins = inv["stock"].to_numpy(), inv["min_required"].to_numpy()
+    critical = stock < mins
+    mask = filter_products(inv["product"], args.get("prefix"))
+    if _flag(args.get("only_critical", False)): mask &= critical
+    view = pd.DataFrame({"product": inv["product"][mask].reset_index(drop=True), "stock": stock[mask],
+                         "min_required": mins[mask], "shortfall": np.maximum(mins - stock, 0)[mask],
+                         "status": np.where(critical, "CRÍTICO", "OK")[mask]})
+    page, matched, offset, limit = page_rows(view, stream_args(args, streaming, len(view)), "shortfall")
+    yield text_piece("ESTADO DE INVENTARIO:")
+    yield from stream_page(page, lambda p: " - " + p["product"] + ": " + p["stock"].astype(str) + " (mín "
+                           + p["min_required"].astype(str) + ") → " + p["status"])
+    yield from stream_lines(page_footer(len(page), matched, offset))
+    structured = {"total": int(len(inv)), "critical": int(critical.sum()), "matched": matched, "offset": offset, "limit": limit}
+    if not streaming:
+        # en streaming las filas ya viajaron como texto
+        structured["items"] = page.to_dict("records")
+    return {"structuredContent": structured}
+
 def tool_inventory_status(args: Dict[str, Any]) -> Dict[str, Any]:
-    inv = load_inventory()
-    lines = ["ESTADO DE INVENTARIO:"]
-    for _, r in inv.iterrows():
-        status = "CRÍTICO" if r["stock"] < r["min_required"] else "OK"
-        lines.append(f" - {r['product']}: {int(r['stock'])} (mín {int(r['min_required'])}) → {status}")
-    return tool_result("\n".join(lines))
+    return collect_stream(stream_inventory_status(args, False))
 
-def tool_inventory_reorder(args: Dict[str, Any]) -> Dict[str, Any]:
-    inv = load_inventory()
+def stream_inventory_reorder(args: Dict[str, Any], streaming: bool = True):
+    # Punto de pedido = max(min_required, demanda prevista en el lead time + stock de seguridad);
+    # se pide hasta safety_factor x punto de pedido. Sin historial de ventas equivale a la regla por mínimo.
+    inv = load_inventory(["product","stock","min_required"])
     lead_days = int(args.get("lead_time_days", 7))
     safety = float(args.get("safety_factor", 1.2))
-    recs=[]
-    for _, r in inv.iterrows():
-        if r["stock"] < r["min_required"]:
-            qty = int(max(0, r["min_required"]*safety - r["stock"]))
-            recs.append(f" - {r['product']}: pedir {qty} (lead {lead_days} días)")
-    text = "SUGERENCIAS DE REABASTECIMIENTO:\n" + ("\n".join(recs) if recs else " Todo en orden.")
-    return tool_result(text)
+    method = "ma" if str(args.get("method") or "").lower() == "ma" else "ema"
+    alpha = min(1.0, max(0.01, float(args.get("alpha", 0.3))))
+    level = min(0.999, max(0.5, float(args.get("service_level", 0.95))))
+    demand = load_demand()
+    daily, sigma = demand.align(inv["product"], *demand.forecast(method, alpha, int(args.get("window", 4))))
+    stock, mins = inv["stock"].to_numpy(), inv["min_required"].to_numpy()
+    safety_stock = statistics.NormalDist().inv_cdf(level) * sigma * math.sqrt(max(lead_days, 0))
+    rop = np.maximum(mins, daily * lead_days + safety_stock)
+    mask = (stock < rop) & filter_products(inv["product"], args.get("prefix"))
+    qty = np.floor(np.maximum(0, rop[mask]*safety - stock[mask])).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(daily[mask] > 0, stock[mask] / daily[mask], np.inf)
+    view = pd.DataFrame({"product": inv["product"][mask].reset_index(drop=True), "stock": stock[mask],
+                         "min_required": mins[mask], "daily_demand": daily[mask].round(3),
+                         "safety_stock": safety_stock[mask].round(1), "reorder_point": np.ceil(rop[mask]).astype(np.int64),
+                         "days_of_cover": np.round(cover, 1), "qty": qty})
+    page, matched, offset, limit = page_rows(view, stream_args(args, streaming, len(view)), "qty")
+    yield text_piece("SUGERENCIAS DE REABASTECIMIENTO:")
+    if page.empty:
+        yield text_piece(" Todo en orden.")
+    yield from stream_page(page, lambda p: " - " + p["product"] + ": pedir " + p["qty"].astype(str) + " (stock " + p["stock"].astype(str)
+                           + ", punto de pedido " + p["reorder_point"].astype(str) + ", " + p["daily_demand"].round(1).astype(str)
+                           + f"/día, lead {lead_days} días)")
+    if not page.empty:
+        yield from stream_lines(page_footer(len(page), matched, offset))
+    structured = {"lead_time_days": lead_days, "safety_factor": safety, "method": method, "service_level": level,
+                  "history_weeks": int(demand.weekly.shape[1]), "history_end": demand.end,
+                  "matched": matched, "offset": offset, "limit": limit}
+    if method == "ema": structured["alpha"] = alpha
+    if not streaming:
+        structured["items"] = page.replace({np.inf: None}).to_dict("records")
+    return {"structuredContent": structured}
+
+def tool_inventory_reorder(args: Dict[str, Any]) -> Dict[str, Any]:
+    return collect_stream(stream_inventory_reorder(args, False))
+
+REPORT_CHUNK_ROWS = int(os.getenv("REPORT_CHUNK_ROWS", "50000"))
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ReportJobs:
+    # Reportes en segundo plano: pool acotado de hilos y estado en FILES_DIR/.jobs/<id>.json,
+    # así cualquier worker de gunicorn puede responder report.status.
+    def __init__(self, jobs_dir: pathlib.Path, workers: int):
+        self.jobs_dir = jobs_dir
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mcp-report")
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        job["updated"] = datetime.now().isoformat()
+        path = self.jobs_dir / f"{job['id']}.json"
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not _JOB_ID_RE.match(job_id or ""): return None
+        try:
+            return json.loads((self.jobs_dir / f"{job_id}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def submit(self, rtype: str, fmt: str) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        ext = "csv" if fmt == "csv" and rtype in ("ventas", "inventario") else "pdf"
+        tenant = current_tenant()
+        job = {"id": job_id, "tenant": tenant.id, "type": rtype, "format": ext, "status": "queued", "progress": 0.0,
+               "file": f"{tenant.files_prefix}reporte_{rtype}_{ts}_{job_id[:8]}.{ext}", "error": None,
+               "created": datetime.now().isoformat()}
+        self._save(job)
+        self.pool.submit(contextvars.copy_context().run, self._run, dict(job))
+        return job
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        job.update(status="running"); self._save(job)
+        final = FILES_DIR / job["file"]
+        final.parent.mkdir(parents=True, exist_ok=True)
+        tmp = final.with_name(f".{final.name}.tmp")
+        def progress(frac: float) -> None:
+            job["progress"] = round(min(frac, 1.0), 3); self._save(job)
+        try:
+            with use_tenant(job.get("tenant")), data_snapshot():
+                REPORT_BUILDERS[(job["type"], job["format"])](tmp, progress)
+            os.replace(tmp, final)
+            job.update(status="done", progress=1.0, size=final.stat().st_size, link=f"/files/{job['file']}")
+        except Exception as e:
+            job.update(status="error", error=str(e))
+        finally:
+            if tmp.exists(): tmp.unlink()
+            self._save(job)
+
+
+def _write_dataset_csv(store, path: pathlib.Path, progress, with_revenue: bool = False) -> None:
+    # se escribe por bloques desde el store (columnas mmap) sin materializar el dataset completo
+    version = DATA_CACHE.entry(store).sig
+    total = dataset_rows(store) or 1
+    done = 0
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        for i, chunk in enumerate(store.iter_chunks(version, REPORT_CHUNK_ROWS)):
+            if with_revenue: chunk = chunk.assign(revenue=chunk["units"]*chunk["unit_price"])
+            chunk.to_csv(fh, index=False, header=(i == 0))
+            done += len(chunk)
+            progress(done / total)
+        if done == 0:
+            pd.DataFrame(columns=store.columns).to_csv(fh, index=False)
+
+def _report_sales_csv(path: pathlib.Path, progress) -> None:
+    _write_dataset_csv(sales_store(), path, progress, with_revenue=True)
+
+def _report_inventory_csv(path: pathlib.Path, progress) -> None:
+    _write_dataset_csv(inv_store(), path, progress)
+
+def _money(values: pd.Series) -> pd.Series:
+    return "$" + values.map("{:,.2f}".format)
+
+def _report_sales_pdf(path: pathlib.Path, progress) -> None:
+    version, total = DATA_CACHE.entry(sales_store()).sig, dataset_rows(sales_store()) or 1
+    def rows():
+        done = 0
+        for chunk in sales_store().iter_chunks(version, REPORT_CHUNK_ROWS):
+            yield from zip(chunk["month"].astype(str), chunk["product"].astype(str), chunk["units"].astype(str),
+                           _money(chunk["unit_price"]), _money(chunk["units"] * chunk["unit_price"]))
+            done += len(chunk)
+            progress(done / total)
+    with open(path, "wb") as fh:
+        pdf = PdfWriter(fh, "Reporte de Ventas")
+        aggs = load_sales_aggregates()
+        pdf.text(f"Ingreso total: {to_currency(aggs.total_revenue)} | Unidades: {aggs.total_units}", bold=True)
+        pdf.table(["Mes", "Producto", "Unidades", "Precio", "Ingreso"], rows(), [1.2, 3, 1, 1.3, 1.5])
+        pdf.close()
+
+def _report_inventory_pdf(path: pathlib.Path, progress) -> None:
+    version, total = DATA_CACHE.entry(inv_store()).sig, dataset_rows(inv_store()) or 1
+    def rows():
+        done = 0
+        for chunk in inv_store().iter_chunks(version, REPORT_CHUNK_ROWS):
+            status = np.where(chunk["stock"].to_numpy() < chunk["min_required"].to_numpy(), "CRÍTICO", "OK")
+            yield from zip(chunk["product"].astype(str), chunk["stock"].astype(str), chunk["min_required"].astype(str), status)
+            done += len(chunk)
+            progress(done / total)
+    with open(path, "wb") as fh:
+        pdf = PdfWriter(fh, "Reporte de Inventario")
+        pdf.table(["Producto", "Stock", "Mínimo", "Estado"], rows(), [4, 1, 1, 1.2])
+        pdf.close()
+
+def _report_general_pdf(path: pathlib.Path, progress) -> None:
+    with open(path, "wb") as fh:
+        pdf = PdfWriter(fh, "Reporte General")
+        pdf.text(tool_sales_summary({})["content"][0]["text"])
+        progress(0.5)
+        pdf.text("")
+        pdf.text(tool_inventory_status({"limit": 10**9})["content"][0]["text"])
+        pdf.close()
+
+REPORT_BUILDERS = {
+    ("ventas", "csv"): _report_sales_csv,
+    ("ventas", "pdf"): _report_sales_pdf,
+    ("inventario", "csv"): _report_inventory_csv,
+    ("inventario", "pdf"): _report_inventory_pdf,
+    ("general", "pdf"): _report_general_pdf,
+}
+REPORT_JOBS = ReportJobs(FILES_DIR / ".jobs", int(os.getenv("REPORT_WORKERS", "2")))
+
+def job_summary(job: Dict[str, Any]) -> str:
+    if job["status"] == "done":
+        return f"Reporte {job['type']} ({job['format'].upper()}) listo: {job['link']}"
+    if job["status"] == "error":
+        return f"Reporte {job['type']} falló: {job['error']}"
+    return f"Reporte {job['type']} ({job['format'].upper()}) {job['status']} ({job['progress']:.0%}). job_id={job['id']}"
 
 def tool_report_generate(args: Dict[str, Any]) -> Dict[str, Any]:
-    rtype = (args.get("type") or "general").lower()  
-    fmt   = (args.get("format") or "csv").lower()    
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    if rtype == "ventas":
-        df = load_sales().assign(revenue=lambda x: x["units"]*x["unit_price"])
-        if fmt=="csv":
-            name=f"reporte_ventas_{ts}.csv"
-            df.to_csv(FILES_DIR/name, index=False, encoding="utf-8")
-            link=f"/files/{name}"
-            return tool_result(f"Reporte de ventas generado: {link}")
-        else:
-            lines = ["REPORTE DE VENTAS"] + [f"{r.product}: {int(r.units)} u, {to_currency(r.unit_price)} c/u" for r in df.itertuples()]
-            pdf = minimal_pdf("Reporte de Ventas", lines)
-            name=f"reporte_ventas_{ts}.pdf"
-            save_file(name, pdf)
-            link=f"/files/{name}"
-            return tool_result(f"Reporte PDF de ventas: {link}")
-    elif rtype == "inventario":
-        df = load_inventory()
-        if fmt=="csv":
-            name=f"reporte_inventario_{ts}.csv"
-            df.to_csv(FILES_DIR/name, index=False, encoding="utf-8")
-            return tool_result(f"Reporte de inventario generado: /files/{name}")
-        else:
-            lines=["REPORTE INVENTARIO"] + [f"{r.product}: stock {int(r.stock)} / min {int(r.min_required)}" for r in df.itertuples()]
-            pdf=minimal_pdf("Reporte de Inventario", lines)
-            name=f"reporte_inventario_{ts}.pdf"
-            save_file(name, pdf)
-            return tool_result(f"Reporte PDF de inventario: /files/{name}")
-    else:
-        lines = ["REPORTE GENERAL",
-                 tool_sales_summary({})["content"][0]["text"],
-                 "",
-                 tool_inventory_status({})["content"][0]["text"]]
-        pdf=minimal_pdf("Reporte General", lines)
-        name=f"reporte_general_{ts}.pdf"
-        save_file(name, pdf)
-        return tool_result(f"Reporte general PDF: /files/{name}")
+    rtype = (args.get("type") or "general").lower()
+    fmt   = (args.get("format") or "csv").lower()
+    if rtype not in ("ventas", "inventario"): rtype = "general"
+    job = REPORT_JOBS.submit(rtype, fmt)
+    # wait=true (opcional): espera hasta 'timeout' segundos para compatibilidad con clientes síncronos
+    if _flag(args.get("wait", False)):
+        deadline = time.monotonic() + float(args.get("timeout", 30))
+        while time.monotonic() < deadline:
+            job = REPORT_JOBS.get(job["id"]) or job
+            if job["status"] in ("done", "error"): break
+            time.sleep(0.05)
+    return tool_result(job_summary(job), job["status"] == "error", structured={"job_id": job["id"], **job})
+
+def tool_report_status(args: Dict[str, Any]) -> Dict[str, Any]:
+    job = REPORT_JOBS.get(str(args.get("job_id") or ""))
+    if not job or job.get("tenant", DEFAULT_TENANT) != current_tenant().id: return tool_result("job_id desconocido", True)
+    return tool_result(job_summary(job), job["status"] == "error", structured={"job_id": job["id"], **job})
 
 def tool_docs_search(args: Dict[str, Any]) -> Dict[str, Any]:
-    q = (args.get("q") or "").strip().lower()
+    q = (args.get("q") or "").strip()
     if not q: return tool_result("Proporcione 'q' (query).", True)
-    found=[]
-    for path in glob.glob(str(DOCS_DIR/"*.txt")):
-        txt = pathlib.Path(path).read_text(encoding="utf-8", errors="ignore").lower()
-        if q in txt:
-            found.append(os.path.basename(path))
-    text = "Coincidencias: " + (", ".join(found) if found else "ninguna")
-    return tool_result(text)
+    k = int(args.get("k", 10))
+    hits = DOCS_INDEX.search_docs(q, k)
+    if not hits: return tool_result("Coincidencias: ninguna")
+    lines = [f"Coincidencias ({len(hits)}):"]
+    for h in hits:
+        lines.append(f" - {h['doc']} (score {h['score']:.3f}, [{h['start']}:{h['end']}]): {h['snippet']}")
+    return tool_result("\n".join(lines))
 
-def tool_ask_llm(args: Dict[str, Any]) -> Dict[str, Any]:
+def docs_summary(st: Dict[str, Any]) -> str:
+    parts = [f"{len(st[k])} {label}" for k, label in (("added", "nuevos"), ("updated", "actualizados"), ("deleted", "eliminados"))]
+    return f"Documentos: {', '.join(parts)}. Corpus: {st['docs']} documentos, {st['bytes']/1e6:.2f} MB."
+
+def tool_docs_ingest(args: Dict[str, Any]) -> Dict[str, Any]:
+    # docs=[{name, text | content_base64}, ...] (o name + text para uno solo); delete=[nombres]
+    items = args.get("docs") or ([{k: args.get(k) for k in ("name", "text", "content_base64")}] if args.get("name") else [])
+    delete = args.get("delete") or []
+    if isinstance(delete, str): delete = [delete]
+    if not items and not delete: return tool_result("Proporcione 'docs' (lista de {name, text|content_base64}) o 'delete'.", True)
+    docs = {}
+    try:
+        for it in items:
+            name = str(it.get("name") or "").strip()
+            if name and not name.endswith(".txt"): name += ".txt"
+            if it.get("content_base64"):
+                text = base64.b64decode(it["content_base64"]).decode("utf-8", errors="ignore")
+            else:
+                text = str(it.get("text") or "")
+            docs[name] = text
+        st = DOCS_INDEX.ingest(docs, [d if d.endswith(".txt") else d + ".txt" for d in map(str, delete)])
+    except (DocsError, ValueError, TypeError, AttributeError) as e:
+        return tool_result(f"Error ingestando documentos: {e}", True)
+    return tool_result(docs_summary(st), False, st)
+
+def stream_ask_llm(args: Dict[str, Any]):
     q = (args.get("query") or "").strip()
-    if not q: return tool_result("Falta 'query'", True)
-    sales = load_sales()
-    inv   = load_inventory()
-    docs  = read_all_docs()
-    ctx   = build_context(sales, inv, docs)
-    answer = llm_answer(q, ctx)
-    return tool_result(answer)
+    if not q:
+        yield text_piece("Falta 'query'")
+        return {"isError": True}
+    # presupuesto en caracteres; max_tokens se aproxima a 4 caracteres por token
+    budget = int(args.get("context_chars") or int(args.get("max_tokens") or 0) * 4 or LLM_CONTEXT_CHARS)
+    key = (current_tenant().id, " ".join(q.lower().split()), budget, DOCS_INDEX.version,
+           DATA_CACHE.entry(sales_store()).sig, DATA_CACHE.entry(inv_store()).sig)
+    ctx = CONTEXT_CACHE.get(key)
+    if ctx is None:
+        aggs = load_sales_aggregates()
+        inv  = load_inventory(["product","stock","min_required"])
+        ctx  = build_context(aggs, inv, q, budget)
+        CONTEXT_CACHE.put(key, ctx, len(ctx.encode("utf-8")))
+    for line in llm_stream(q, ctx):
+        yield text_piece(line)
+
+def tool_ask_llm(args: Dict[str, Any]) -> Dict[str, Any]:
+    return collect_stream(stream_ask_llm(args))
+
+AGG_WORKERS = int(os.getenv("MCP_AGG_WORKERS", str(min(4, os.cpu_count() or 1))))
+AGG_START_METHOD = os.getenv("MCP_AGG_START_METHOD", "spawn")   # spawn: seguro con hilos; cada worker importa el módulo una vez
+_AGG_POOL: Optional[ProcessPoolExecutor] = None
+_AGG_POOL_LOCK = threading.Lock()
+
+def agg_pool(broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+    # 'broken': pool cuyo worker murió; se descarta y se crea otro en la siguiente llamada
+    global _AGG_POOL
+    with _AGG_POOL_LOCK:
+        if broken is not None and _AGG_POOL is broken:
+            _AGG_POOL = None
+            broken.shutdown(wait=False)
+            return None
+        if _AGG_POOL is None:
+            _AGG_POOL = ProcessPoolExecutor(AGG_WORKERS, mp_context=multiprocessing.get_context(AGG_START_METHOD))
+        return _AGG_POOL
+
+def sales_partial(tid: str, version: tuple, start_ns: Optional[int], end_ns: Optional[int]) -> Dict[str, Any]:
+    # Agregado parcial de un shard, en un proceso del pool: lee las columnas del store (mmap) y devuelve
+    # solo tablas pequeñas por producto y por mes, que el proceso principal combina.
+    d = TenantRegistry.path(tid)
+    store = CsvStore(d / "sales.csv", SALES_DTYPES) if STORAGE_BACKEND == "csv" else NpyStore(d / "sales.npy", SALES_DTYPES, SORT_KEYS["sales"])
+    cols = store.read(version, ["date","product","units","unit_price"])
+    dates = cols["date"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    if store.sorted_by(version) == "date":
+        lo = 0 if start_ns is None else int(np.searchsorted(dates, start_ns))
+        hi = len(dates) if end_ns is None else int(np.searchsorted(dates, end_ns))
+        sel: Any = slice(lo, max(lo, hi))
+    else:
+        sel = np.ones(len(dates), dtype=bool)
+        if start_ns is not None: sel &= dates >= start_ns
+        if end_ns is not None: sel &= dates < end_ns
+    cats = cols["product"].cat.categories
+    codes = cols["product"].cat.codes.to_numpy()[sel]
+    units = cols["units"].to_numpy()[sel]
+    revenue = units * cols["unit_price"].to_numpy()[sel]
+    sel_dates = dates[sel]
+    valid = codes >= 0   # ventas sin producto quedan fuera, como en SalesAggregates
+    if not valid.all(): codes, units, revenue, sel_dates = codes[valid], units[valid], revenue[valid], sel_dates[valid]
+    p_units = np.bincount(codes, weights=units, minlength=len(cats))
+    p_rev = np.bincount(codes, weights=revenue, minlength=len(cats))
+    nz = np.flatnonzero((p_units != 0) | (p_rev != 0))
+    months, inv = np.unique(sel_dates.view("datetime64[ns]").astype("datetime64[M]"), return_inverse=True)
+    return {"tenant": tid, "rows": int(len(units)), "units": int(units.sum()), "revenue": float(revenue.sum()),
+            "by_product": pd.DataFrame({"product": np.asarray(cats[nz], dtype=object), "units": p_units[nz], "revenue": p_rev[nz]}),
+            "by_month": pd.DataFrame({"month": months.astype(str), "units": np.bincount(inv, weights=units, minlength=len(months)),
+                                      "revenue": np.bincount(inv, weights=revenue, minlength=len(months))})}
+
+def tool_tenants_sales(args: Dict[str, Any]) -> Dict[str, Any]:
+    # Ventas agregadas entre tenants: un parcial por shard en el pool de procesos (en paralelo y fuera del GIL,
+    # así un tenant grande no frena a los demás) y combinación de las tablas pequeñas. Los parciales se
+    # cachean por (tenant, versión, rango).
+    ids = args.get("tenants") or TENANTS.ids()
+    if isinstance(ids, str): ids = [x.strip() for x in ids.split(",") if x.strip()]
+    ids = list(dict.fromkeys(str(t).lower() for t in ids))
+    unknown = [t for t in ids if not _TENANT_ID_RE.match(t) or (t != DEFAULT_TENANT and not (TENANTS_DIR / t).is_dir())]
+    if unknown: return tool_result(f"Tenants desconocidos: {', '.join(unknown)}", True)
+    by = str(args.get("by") or "tenant").lower()
+    if by not in ("tenant", "product", "month"): by = "tenant"
+    try:
+        start, end = parse_period_bound(args.get("start")), parse_period_bound(args.get("end"), end=True)
+    except ValueError as e:
+        return tool_result(f"Parámetros inválidos: {e}", True)
+    bounds = tuple(None if b is None else int(b.astype("datetime64[ns]").astype(np.int64)) for b in (start, end))
+    partials, errors, futures, pool = [], {}, {}, agg_pool()
+    for tid in ids:
+        # sin abrir el tenant en el registro (no desplaza las cachés de los activos); make_store migra si hace falta
+        # (la versión se fija aquí: el worker lee esa, aunque mientras tanto se publique otra)
+        version = make_store("sales", TenantRegistry.path(tid)).version()
+        key = ("tenants.partial", tid, version, bounds)
+        cached = RESULT_CACHE.get(key)
+        if cached is not None: partials.append(cached)
+        else: futures[tid] = (key, pool.submit(sales_partial, tid, version, *bounds))
+    for tid, (key, fut) in futures.items():
+        try:
+            part = fut.result()
+        except BrokenProcessPool as e:
+            agg_pool(broken=pool)
+            errors[tid] = str(e); continue
+        except Exception as e:
+            errors[tid] = str(e); continue
+        RESULT_CACHE.put(key, part, approx_nbytes(part))
+        partials.append(part)
+    partials.sort(key=lambda p: -p["revenue"])
+    per_tenant = [{k: p[k] for k in ("tenant", "rows", "units", "revenue")} for p in partials]
+    total_rev, total_units = sum(p["revenue"] for p in partials), sum(p["units"] for p in partials)
+    lines = [f"VENTAS ENTRE TENANTS ({len(partials)} de {len(ids)}): {to_currency(total_rev)}, {total_units} unidades"]
+    if by == "tenant":
+        items = per_tenant
+        lines += [f" - {p['tenant']}: {to_currency(p['revenue'])} ({p['units']} u, {p['rows']} filas)" for p in items]
+    else:
+        frames = [p["by_" + by] for p in partials]
+        merged = (pd.concat(frames, ignore_index=True).groupby(by, sort=(by == "month"))[["units","revenue"]].sum()
+                  if frames else pd.DataFrame(columns=["units","revenue"]))
+        if by == "product":
+            merged = merged.sort_values("revenue", ascending=False).head(max(1, int(args.get("n", 10))))
+        items = [{by: str(k), "units": int(r.units), "revenue": round(float(r.revenue), 2)} for k, r in merged.iterrows()]
+        lines += [f" - {it[by]}: {to_currency(it['revenue'])} ({it['units']} u)" for it in items]
+    lines += [f" ! {tid}: {msg}" for tid, msg in errors.items()]
+    structured = {"by": by, "tenants": per_tenant, "items": items, "total_revenue": round(total_rev, 2),
+                  "total_units": total_units, "errors": errors}
+    return tool_result("\n".join(lines), bool(errors) and not partials, structured)
 
 def tool_ingest_csv(args: Dict[str, Any]) -> Dict[str, Any]:
     kind = (args.get("kind") or "").lower()
     b64  = args.get("csv_base64")
+    mode = (args.get("mode") or "replace").lower()
     if kind not in ("sales","inventory"): return tool_result("kind debe ser 'sales' o 'inventory'", True)
     if not b64: return tool_result("Falta csv_base64", True)
     try:
-        raw = base64.b64decode(b64)
-        df = pd.read_csv(io.BytesIO(raw))
-        if kind=="sales":
-            for col in ["month","product","units","unit_price"]:
-                if col not in df.columns: return tool_result(f"CSV ventas sin columna {col}", True)
-            df.to_csv(SALES_CSV, index=False, encoding="utf-8")
-        else:
-            for col in ["product","stock","min_required"]:
-                if col not in df.columns: return tool_result(f"CSV inventario sin columna {col}", True)
-            df.to_csv(INV_CSV, index=False, encoding="utf-8")
-        return tool_result(f"Datos '{kind}' actualizados ({len(df)} filas).")
+        year = int(args["year"]) if args.get("year") else None
+        st = ingest_stream(kind, io.BytesIO(base64.b64decode(b64)), mode, year)
+        return tool_result(ingest_summary(st))
     except Exception as e:
         return tool_result(f"Error ingestando CSV: {e}", True)
 
 TOOLS: Dict[str, Dict[str, Any]] = {
-    "sales.summary":               {"description": "Resumen de ventas (opcional: month)", "func": tool_sales_summary,
+    "sales.summary":               {"description": "Resumen de ventas (opcional: month)", "func": tool_sales_summary, "stream": stream_sales_summary, "cacheable": True,
                                     "inputSchema":{"type":"object","properties":{"month":{"type":"string"}}}},
-    "sales.top":                   {"description": "Top N productos por revenue|units", "func": tool_sales_top,
+    "sales.top":                   {"description": "Top N productos por revenue|units", "func": tool_sales_top, "cacheable": True,
                                     "inputSchema":{"type":"object","properties":{"n":{"type":"integer"}, "by":{"type":"string"}}}},
-    "inventory.status":            {"description": "Estado actual del inventario (críticos/OK)", "func": tool_inventory_status,
-                                    "inputSchema":{"type":"object","properties":{}}},
-    "inventory.reorder_suggestions":{"description":"Sugerencias de reabastecimiento", "func": tool_inventory_reorder,
-                                    "inputSchema":{"type":"object","properties":{"lead_time_days":{"type":"integer"},"safety_factor":{"type":"number"}}}},
-    "report.generate":             {"description": "Genera reportes CSV/PDF (ventas|inventario|general)", "func": tool_report_generate,
-                                    "inputSchema":{"type":"object","properties":{"type":{"type":"string"},"format":{"type":"string"}}}},
-    "docs.search":                 {"description": "Búsqueda simple en documentos internos (.txt)", "func": tool_docs_search,
-                                    "inputSchema":{"type":"object","properties":{"q":{"type":"string"}},"required":["q"]}},
-    "llm.ask":                     {"description": "Pregunta en lenguaje natural usando contexto de ventas+inventario+docs", "func": tool_ask_llm,
-                                    "inputSchema":{"type":"object","properties":{"query":{"type":"string"}},"required":["query"]}},
-    "admin.ingest_csv":            {"description": "Ingesta de CSV (sales|inventory) vía base64", "func": tool_ingest_csv,
-                                    "inputSchema":{"type":"object","properties":{"kind":{"type":"string"},"csv_base64":{"type":"string"}},"required":["kind","csv_base64"]}},
+    "sales.timeseries":            {"description": "Serie temporal de ventas: rango start/end (YYYY[-MM[-DD]]), freq D|W|M, variación entre periodos y media móvil", "func": tool_sales_timeseries, "stream": stream_sales_timeseries, "cacheable": True,
+                                    "inputSchema":{"type":"object","properties":{"start":{"type":"string"},"end":{"type":"string"},"freq":{"type":"string","enum":list(TIMESERIES_FREQS)},"metric":{"type":"string","enum":["revenue","units"]},"window":{"type":"integer"},"product":{"type":"string"}}}},
+    "inventory.status":            {"description": "Estado actual del inventario (críticos/OK)", "func": tool_inventory_status, "stream": stream_inventory_status, "cacheable": True,
+                                    "inputSchema":{"type":"object","properties":{"only_critical":{"type":"boolean"},"prefix":{"type":"string"},"top_k":{"type":"integer"},"sort":{"type":"string"},"offset":{"type":"integer"},"limit":{"type":"integer"}}}},
+    "inventory.reorder_suggestions":{"description":"Sugerencias de reabastecimiento según demanda prevista (ema|ma) en el lead time", "func": tool_inventory_reorder, "stream": stream_inventory_reorder, "cacheable": True,
+                                    "inputSchema":{"type":"object","properties":{"lead_time_days":{"type":"integer"},"safety_factor":{"type":"number"},"method":{"type":"string","enum":["ema","ma"]},"alpha":{"type":"number"},"window":{"type":"integer"},"service_level":{"type":"number"},"prefix":{"type":"string"},"top_k":{"type":"integer"},"sort":{"type":"string"},"offset":{"type":"integer"},"limit":{"type":"integer"}}}},
+    "tenants.sales_summary":       {"description": "Ventas agregadas entre tenants (by=tenant|product|month; tenants, start, end, n)", "func": tool_tenants_sales,
+                                    "inputSchema":{"type":"object","properties":{"tenants":{"type":"array","items":{"type":"string"}},"by":{"type":"string","enum":["tenant","product","month"]},"start":{"type":"string"},"end":{"type":"string"},"n":{"type":"integer"}}}},
+    "report.generate":             {"description": "Genera reportes CSV/PDF (ventas|inventario|general) en segundo plano; devuelve job_id", "func": tool_report_generate,
+                                    "inputSchema":{"type":"object","properties":{"type":{"type":"string"},"format":{"type":"string"},"wait":{"type":"boolean"},"timeout":{"type":"number"}}}},
+    "report.status":               {"description": "Estado/progreso de un reporte (job_id)", "func": tool_report_status,
+                                    "inputSchema":{"type":"object","properties":{"job_id":{"type":"string"}},"required":["job_id"]}},
+    "docs.search":                 {"description": "Búsqueda BM25 en documentos internos (.txt); frases entre comillas", "func": tool_docs_search, "cacheable": True,
+                                    "inputSchema":{"type":"object","properties":{"q":{"type":"string"},"k":{"type":"integer"}},"required":["q"]}},
+    "docs.ingest":                 {"description": "Alta/actualización de documentos (.txt) en el corpus, uno o varios; delete=[nombres] para eliminar. Para archivos usar POST /mcp/ingest/docs", "func": tool_docs_ingest, "mutates": True,
+                                    "inputSchema":{"type":"object","properties":{"docs":{"type":"array","items":{"type":"object","properties":{"name":{"type":"string"},"text":{"type":"string"},"content_base64":{"type":"string"}},"required":["name"]}},
+                                                   "name":{"type":"string"},"text":{"type":"string"},"delete":{"type":"array","items":{"type":"string"}}}}},
+    "llm.ask":                     {"description": "Pregunta en lenguaje natural usando contexto de ventas+inventario+docs", "func": tool_ask_llm, "stream": stream_ask_llm,
+                                    "inputSchema":{"type":"object","properties":{"query":{"type":"string"},"context_chars":{"type":"integer"},"max_tokens":{"type":"integer"}},"required":["query"]}},
+    "admin.ingest_csv":            {"description": "Ingesta de CSV (sales|inventory) vía base64; mode=replace|append|upsert. Para archivos grandes usar POST /mcp/ingest/<kind>", "func": tool_ingest_csv, "mutates": True,
+                                    "inputSchema":{"type":"object","properties":{"kind":{"type":"string"},"csv_base64":{"type":"string"},"mode":{"type":"string","enum":list(INGEST_MODES)},"year":{"type":"integer"}},"required":["kind","csv_base64"]}},
 }
 
 
@@ -287,42 +2426,297 @@ def root():
         "status":"ok",
         "version":"2.0.0",
         "timestamp": datetime.now().isoformat(),
-        "endpoints":["/health","/mcp/tools/list","/mcp/tools/call","/files/<name>"]
+        "endpoints":["/health","/metrics","/metrics/slow","/mcp/tools/list","/mcp/tools/call","/mcp/ingest/<kind>","/files/<name>"]
     })
 
 @app.route("/health", methods=["GET"])
 def health():
-    s = load_sales()
-    i = load_inventory()
+    try:
+        with use_tenant(request.args.get("tenant") or request.headers.get("X-Tenant")) as t:
+            rows = {"tenant": t.id, "sales": dataset_rows(t.sales), "inventory": dataset_rows(t.inventory)}
+            versions = {"sales": version_id(t.sales.version()), "inventory": version_id(t.inventory.version())}
+    except TenantError as e:
+        return jsonify({"status": "error", "error": str(e)}), 404
     return jsonify({
         "status":"healthy",
-        "rows":{"sales":int(len(s)), "inventory":int(len(i))},
+        "storage": STORAGE_BACKEND,
+        "rows": rows,
+        "versions": dict(versions, gc=VERSION_GC.stats()),
+        "tenants": TENANTS.stats(),
+        "docs": DOCS_INDEX.stats(),
+        "cache": DATA_CACHE.snapshot_stats(),
+        "result_cache": RESULT_CACHE.stats(),
         "time": datetime.now().isoformat()
     })
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # formato de exposición de Prometheus (text 0.0.4)
+    return app.response_class(render_metrics(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/metrics/slow", methods=["GET"])
+def metrics_slow():
+    return jsonify({"threshold_ms": SLOW_CALL_MS, "calls": list(METRICS.recent_slow)})
+
 @app.route("/mcp/tools/list", methods=["GET"])
 def list_tools():
-    tools = [{"name":k,"description":v["description"],"inputSchema":v.get("inputSchema",{"type":"object"})} for k,v in TOOLS.items()]
+    # todas las herramientas aceptan 'tenant' (o la cabecera X-Tenant)
+    def schema(v):
+        s = dict(v.get("inputSchema", {"type":"object"}))
+        s["properties"] = dict(s.get("properties", {}), tenant={"type":"string"})
+        return s
+    tools = [{"name":k,"description":v["description"],"inputSchema":schema(v)} for k,v in TOOLS.items()]
     return jsonify({"tools": tools})
 
+MAX_BATCH = int(os.getenv("MCP_MAX_BATCH", "50"))
+BATCH_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("MCP_BATCH_WORKERS", "4")), thread_name_prefix="mcp-batch")
+
+def parse_call(data: Any) -> Tuple[Any, Optional[str], Dict[str, Any], Optional[str]]:
+    # acepta el formato propio {"id","name","arguments"} y el JSON-RPC {"method":"tools/call","params":{...}};
+    # el tenant puede venir en arguments.tenant o junto al nombre
+    if not isinstance(data, dict): return None, None, {}, None
+    params = data.get("params") if isinstance(data.get("params"), dict) else data
+    args = dict(params.get("arguments", {}) or {})
+    tenant = args.pop("tenant", None) or params.get("tenant")
+    return data.get("id", str(uuid.uuid4())), params.get("name"), args, tenant
+
+def data_version() -> Tuple[Any, ...]:
+    DOCS_INDEX.ensure_watching()
+    return (DATA_CACHE.entry(sales_store()).sig, DATA_CACHE.entry(inv_store()).sig, DOCS_INDEX.version)
+
+def result_etag(name: str, args: Dict[str, Any]) -> Tuple[Tuple[Any, ...], str]:
+    # clave = tenant + herramienta + argumentos canónicos + versión de los datos; el ETag es su hash
+    key = (current_tenant().id, name, json.dumps(args, sort_keys=True, ensure_ascii=False, default=str), data_version())
+    return key, hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+def run_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    # ejecuta la herramienta midiendo fases; "compute" es el total menos la carga de datos
+    phases: Dict[str, float] = {}
+    token = _PHASES.set(phases)
+    t0 = time.perf_counter()
+    outcome, prof = "exception", {}
+    try:
+        with METRICS.profile() as prof:
+            result = TOOLS[name]["func"](args)
+        outcome = "error" if result.get("isError") else "ok"
+        return result
+    finally:
+        _PHASES.reset(token)
+        dt = time.perf_counter() - t0
+        phases["compute"] = max(0.0, dt - phases.get("load", 0.0))
+        METRICS.observe(name, dt, outcome, phases)
+        if dt * 1000 >= SLOW_CALL_MS:
+            METRICS.slow_call(name, dt, args, phases, prof)
+
+def execute_call(req_id: Any, name: Optional[str], args: Dict[str, Any], key: Optional[tuple] = None,
+                 tenant: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    if name not in TOOLS:
+        METRICS.observe("_unknown", 0.0, "not_found")
+        return rpc_err(req_id, f"Tool '{name}' no encontrado", -32601), 400
+    try:
+        # las herramientas que escriben crean el tenant si aún no existe; las de lectura fijan la versión de
+        # los datos durante toda la llamada (una ingesta en paralelo publica otra versión sin afectarlas)
+        mutates = bool(TOOLS[name].get("mutates"))
+        with use_tenant(tenant, create=mutates), (contextlib.nullcontext() if mutates else data_snapshot()):
+            return _execute_call(req_id, name, args, key)
+    except TenantError as e:
+        return rpc_err(req_id, str(e), -32602), 400
+
+def _execute_call(req_id: Any, name: str, args: Dict[str, Any], key: Optional[tuple]) -> Tuple[Dict[str, Any], int]:
+    cacheable = TOOLS[name].get("cacheable")
+    if cacheable:
+        t0 = time.perf_counter()
+        key = key or result_etag(name, args)[0]
+        result = RESULT_CACHE.get(key)
+        if result is not None:
+            METRICS.observe(name, time.perf_counter() - t0, "cache_hit")
+            return rpc_ok(req_id, result), 200
+    try:
+        result = run_tool(name, args)
+    except Exception as e:
+        return rpc_err(req_id, f"Error ejecutando '{name}': {e}"), 500
+    if cacheable and not result.get("isError"):
+        t0 = time.perf_counter()
+        size = len(json.dumps(result, ensure_ascii=False, default=str))
+        METRICS.add_phase(name, "serialize", time.perf_counter() - t0)
+        RESULT_CACHE.put(key, result, size)
+    return rpc_ok(req_id, result), 200
+
+def execute_batch(items: List[Any], default_tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Todas las llamadas ven la misma versión de los datos (de cada tenant). Las de solo lectura corren en
+    # paralelo; las que escriben (mutates) se ejecutan después, en orden, para no alterar lo que leen las demás.
+    calls = [(req_id, name, args, tenant or default_tenant) for req_id, name, args, tenant in map(parse_call, items)]
+    out: List[Optional[Dict[str, Any]]] = [None] * len(calls)
+    with data_snapshot(list(dict.fromkeys(c[3] for c in calls))):
+        futures = {}
+        for i, (req_id, name, args, tenant) in enumerate(calls):
+            if name is None:
+                out[i] = rpc_err(req_id, "Llamada inválida: falta 'name'", -32600)
+            elif not TOOLS.get(name, {}).get("mutates"):
+                ctx = contextvars.copy_context()
+                futures[i] = BATCH_POOL.submit(ctx.run, execute_call, req_id, name, args, None, tenant)
+        for i, fut in futures.items():
+            out[i] = fut.result()[0]
+        for i, (req_id, name, args, tenant) in enumerate(calls):
+            if out[i] is None:
+                out[i] = execute_call(req_id, name, args, None, tenant)[0]
+    return out
+
+def _buffered_stream(func, args: Dict[str, Any]):
+    # herramientas sin variante en streaming: se ejecutan completas y se emiten sus piezas
+    result = func(args)
+    yield from result.get("content", [])
+    return {k: v for k, v in result.items() if k != "content"}
+
+def stream_call(req_id: Any, name: str, args: Dict[str, Any], phases: Dict[str, float], tenant: str):
+    # El generador de la herramienta corre en un contexto propio (tenant, versión de datos fijada y fases de la
+    # llamada), así el estado no se mezcla con el hilo del servidor entre una pieza y la siguiente.
+    t = TENANTS.acquire(tenant)
+    ctx = contextvars.copy_context()
+    ctx.run(_TENANT.set, t)
+    ctx.run(_PHASES.set, phases)
+    pinned = pin_datasets(t)
+    pins = VERSION_GC.pin(pinned)
+    ctx.run(_SNAPSHOT.set, pinned)
+    spec = TOOLS[name]
+    gen = spec["stream"](args) if "stream" in spec else _buffered_stream(spec["func"], args)
+    t0, outcome = time.perf_counter(), "aborted"
+    try:
+        while True:
+            try:
+                piece = ctx.run(next, gen)
+            except StopIteration as stop:
+                meta = stop.value or {}
+                break
+            yield "content", {"id": req_id, "content": piece}
+        outcome = "error" if meta.get("isError") else "ok"
+        yield "result", rpc_ok(req_id, dict(meta, isError=bool(meta.get("isError"))))
+    except Exception as e:
+        outcome = "exception"
+        yield "error", rpc_err(req_id, f"Error ejecutando '{name}': {e}")
+    finally:
+        ctx.run(gen.close)
+        VERSION_GC.unpin(pins)
+        TENANTS.release(t)
+        dt = time.perf_counter() - t0
+        phases["compute"] = max(0.0, dt - phases.get("load", 0.0) - phases.get("serialize", 0.0))
+        METRICS.observe(name, dt, outcome, phases)
+        if dt * 1000 >= SLOW_CALL_MS:
+            METRICS.slow_call(name, dt, args, phases, {})
+
+STREAM_MIMETYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+def stream_format() -> Optional[str]:
+    # opt-in: ?stream=sse|ndjson o Accept: text/event-stream | application/x-ndjson
+    fmt = (request.args.get("stream") or "").lower()
+    if fmt in STREAM_MIMETYPES: return fmt
+    accept = request.headers.get("Accept", "")
+    return next((f for f, mt in STREAM_MIMETYPES.items() if mt in accept), None)
+
+def stream_response(fmt: str, req_id: Any, name: str, args: Dict[str, Any]):
+    tenant = current_tenant().id
+    def body():
+        phases: Dict[str, float] = {}
+        for event, payload in stream_call(req_id, name, args, phases, tenant):
+            t0 = time.perf_counter()
+            if fmt == "sse":
+                chunk = f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+            else:
+                chunk = json.dumps(dict(payload, event=event), ensure_ascii=False, default=str) + "\n"
+            phases["serialize"] = phases.get("serialize", 0.0) + time.perf_counter() - t0
+            yield chunk.encode("utf-8")
+    return app.response_class(body(), mimetype=STREAM_MIMETYPES[fmt],
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def timed_jsonify(name: Optional[str], payload: Dict[str, Any], status: int):
+    t0 = time.perf_counter()
+    resp = jsonify(payload)
+    resp.status_code = status
+    if name in TOOLS:
+        METRICS.add_phase(name, "serialize", time.perf_counter() - t0)
+    return resp
+
 @app.route("/mcp/tools/call", methods=["POST"])
 def call_tool():
     data = request.get_json(force=True) or {}
-    name = data.get("name")
-    args = data.get("arguments", {}) or {}
-    req_id = data.get("id", str(uuid.uuid4()))
+    if isinstance(data, list):
+        if not data:
+            return jsonify(rpc_err(None, "Batch vacío", -32600)), 400
+        if len(data) > MAX_BATCH:
+            return jsonify(rpc_err(None, f"Batch demasiado grande ({len(data)} > {MAX_BATCH})", -32600)), 413
+        return jsonify(execute_batch(data, request.headers.get("X-Tenant"))), 200
+    req_id, name, args, tenant = parse_call(data)
     if name not in TOOLS:
-        return jsonify(rpc_err(req_id, f"Tool '{name}' no encontrado")), 400
+        return timed_jsonify(name, *execute_call(req_id, name, args))
+    try:
+        mutates = bool(TOOLS[name].get("mutates"))
+        with use_tenant(tenant or request.headers.get("X-Tenant"), create=mutates), \
+                (contextlib.nullcontext() if mutates else data_snapshot()):   # el ETag y el resultado, de la misma versión
+            return dispatch_call(req_id, name, args)
+    except TenantError as e:
+        return jsonify(rpc_err(req_id, str(e), -32602)), 400
+
+def dispatch_call(req_id: Any, name: str, args: Dict[str, Any]):
+    fmt = stream_format()
+    if fmt and name in TOOLS:
+        # las respuestas en streaming no pasan por la caché de resultados ni por ETag
+        return stream_response(fmt, req_id, name, args)
+    if not TOOLS.get(name, {}).get("cacheable"):
+        payload, status = execute_call(req_id, name, args)
+        return timed_jsonify(name, payload, status)
+    t0 = time.perf_counter()
+    key, etag = result_etag(name, args)
+    if request.if_none_match.contains(etag):
+        METRICS.observe(name, time.perf_counter() - t0, "not_modified")
+        resp = app.response_class(status=304)
+    else:
+        payload, status = execute_call(req_id, name, args, key)
+        resp = timed_jsonify(name, payload, status)
+    if resp.status_code in (200, 304):
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+RAW_CSV_TYPES = ("", "text/csv", "application/csv", "text/plain", "application/octet-stream")
+
+@app.route("/mcp/ingest/<kind>", methods=["POST"])
+def ingest_upload(kind: str):
+    # Subida por streaming: cuerpo CSV crudo (text/csv, admite chunked) o multipart con campo 'file'.
+    # kind=docs: multipart con uno o varios campos 'file'/'files' (.txt), indexados en una sola actualización.
+    req_id = request.args.get("id", str(uuid.uuid4()))
+    if kind.lower() == "docs":
+        files = request.files.getlist("files") + request.files.getlist("file")
+        if not files: return jsonify(rpc_err(req_id, "Envíe los documentos como multipart (campo 'files')", -32602)), 400
+        try:
+            st = DOCS_INDEX.ingest({pathlib.PurePath(f.filename or "").name: f.read().decode("utf-8", errors="ignore") for f in files})
+        except DocsError as e:
+            return jsonify(rpc_err(req_id, str(e), -32602)), 400
+        return jsonify(rpc_ok(req_id, tool_result(docs_summary(st), False, st))), 200
+    if request.mimetype == "multipart/form-data":
+        if "file" not in request.files: return jsonify(rpc_err(req_id, "Falta el campo 'file' con el CSV", -32602)), 400
+        src = request.files["file"].stream
+    elif request.mimetype in RAW_CSV_TYPES:
+        src = request.stream
+    else:
+        return jsonify(rpc_err(req_id, f"Content-Type no soportado: {request.mimetype}; use text/csv o multipart/form-data", -32602)), 415
+    mode = (request.args.get("mode") or request.form.get("mode") or "replace").lower()
+    year = request.args.get("year") or request.form.get("year")
+    if year and not year.isdigit(): return jsonify(rpc_err(req_id, f"year inválido: {year!r}", -32602)), 400
     try:
-        result = TOOLS[name]["func"](args)
-        return jsonify(rpc_ok(req_id, result)), 200
+        with use_tenant(request.args.get("tenant") or request.headers.get("X-Tenant"), create=True):
+            st = ingest_stream(kind.lower(), src, mode, int(year) if year else None)
+    except (IngestError, TenantError) as e:
+        return jsonify(rpc_err(req_id, str(e), -32602)), 400
     except Exception as e:
-        return jsonify(rpc_err(req_id, f"Error ejecutando '{name}': {e}")), 500
+        return jsonify(rpc_err(req_id, f"Error ingestando CSV: {e}")), 500
+    return jsonify(rpc_ok(req_id, dict(tool_result(ingest_summary(st)), stats=st))), 200
 
 @app.route("/files/<path:fname>", methods=["GET"])
 def files_serve(fname: str):
-    # descarga de archivos generados
-    return send_from_directory(FILES_DIR, fname, as_attachment=True)
+    # descarga de archivos generados (admite Range para descargas parciales/reanudables)
+    if any(part.startswith(".") for part in pathlib.PurePosixPath(fname).parts):
+        return jsonify({"error": "no encontrado"}), 404
+    return send_from_directory(FILES_DIR, fname, as_attachment=True, conditional=True)
 
 if __name__=="__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -1,42 +1,253 @@
-import aiohttp, asyncio, base64, json, re, pathlib
+import aiohttp, asyncio, argparse, contextlib, json, os, re, random, pathlib, sys, time
+from typing import List, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 
 # BASE_URL = "http://127.0.0.1:5000"
-BASE_URL = "https://proyecto1-redes.onrender.com"
+BASE_URL = os.getenv("MCP_BASE_URL", "https://proyecto1-redes.onrender.com")
+# salida en streaming (NDJSON): las piezas se muestran a medida que llegan; se alterna con /stream on|off
+STREAM_OUTPUT = os.getenv("MCP_STREAM", "0") == "1"
+# tienda (tenant) sobre la que se trabaja; se envía en la cabecera X-Tenant y se cambia con /tenant <id>
+TENANT = os.getenv("MCP_TENANT", "")
 
 console = Console()
 
 
+class MCPClient:
+    # Sesión aiohttp de larga vida: pool de conexiones keep-alive (sin handshake TCP/TLS por llamada),
+    # timeouts configurables y reintentos con backoff exponencial ante fallos de red o 502/503/504.
+    # Las herramientas que escriben solo se reintentan si la conexión no llegó a establecerse: si la
+    # petición ya salió, el servidor pudo aplicarla y repetirla duplicaría el efecto.
+    RETRY_STATUS = (502, 503, 504)
+    WRITE_TOOLS = frozenset({"admin.ingest_csv", "docs.ingest", "report.generate"})
+    BATCH_REJECT_STATUS = (400, 404, 405)   # el servidor no acepta el sobre batch: no se vuelve a intentar
+
+    def __init__(self, base_url: str = BASE_URL, timeout: float = 60.0, connect_timeout: float = 10.0,
+                 retries: int = 3, backoff: float = 0.5, pool_size: int = 20, concurrency: int = 8,
+                 cache_size: int = 256, tenant: str = TENANT):
+        self.base_url = base_url.rstrip("/")
+        self.tenant = tenant
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries, self.backoff, self.pool_size = retries, backoff, pool_size
+        self.concurrency = concurrency
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._batch_ok: Optional[bool] = None
+        self.cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.cache_size = cache_size
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def _headers(self, headers: Optional[dict] = None) -> dict:
+        return dict({"X-Tenant": self.tenant} if self.tenant else {}, **(headers or {}))
+
+    async def send(self, method: str, path: str, retries: Optional[int] = None, idempotent: bool = True, **kw):
+        # devuelve (status, json|None, headers); 304 no trae cuerpo
+        session = await self.start()
+        kw["headers"] = self._headers(kw.get("headers"))
+        attempts = (self.retries if retries is None else retries) + 1
+        for attempt in range(attempts):
+            try:
+                async with session.request(method, f"{self.base_url}{path}", **kw) as r:
+                    if r.status in self.RETRY_STATUS and idempotent and attempt < attempts - 1:
+                        raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status)
+                    data = None if r.status == 304 else await r.json(content_type=None)
+                    return r.status, data, r.headers
+            except aiohttp.ClientConnectorError:
+                if attempt >= attempts - 1: raise
+            except (aiohttp.ClientConnectionError, aiohttp.ClientResponseError, asyncio.TimeoutError):
+                if not idempotent or attempt >= attempts - 1: raise
+            await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    async def request(self, method: str, path: str, retries: Optional[int] = None, idempotent: bool = True, **kw):
+        status, data, _ = await self.send(method, path, retries, idempotent, **kw)
+        return status, data
+
+    async def get(self, path: str):
+        return (await self.request("GET", path))[1]
+
+    async def post(self, path: str, payload, idempotent: bool = True):
+        return await self.request("POST", path, idempotent=idempotent, json=payload)
+
+    async def call(self, name: str, arguments: dict):
+        # caché local por (tool, args): se envía If-None-Match y ante 304 se reutiliza el resultado
+        payload = {"id": f"req-{datetime.now().timestamp()}", "name": name, "arguments": arguments}
+        key = (self.tenant, name, json.dumps(arguments, sort_keys=True, ensure_ascii=False))
+        cached = self.cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        status, data, resp_headers = await self.send("POST", "/mcp/tools/call", idempotent=name not in self.WRITE_TOOLS,
+                                                     json=payload, headers=headers)
+        if status == 304 and cached:
+            self.cache.move_to_end(key)
+            return status, {"jsonrpc": "2.0", "id": payload["id"], "result": cached[1]}
+        etag = resp_headers.get("ETag")
+        if etag and isinstance(data, dict) and "result" in data:
+            self.cache[key] = (etag, data["result"])
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+        return status, data
+
+    async def stream(self, name: str, arguments: dict):
+        # genera los eventos NDJSON del servidor: {"event":"content",...}, y al final "result" o "error".
+        # Sin reintentos: parte de la respuesta ya pudo mostrarse.
+        session = await self.start()
+        payload = {"id": f"req-{datetime.now().timestamp()}", "name": name, "arguments": arguments}
+        async with session.post(f"{self.base_url}/mcp/tools/call", params={"stream": "ndjson"}, json=payload,
+                                headers=self._headers({"Accept": "application/x-ndjson"})) as r:
+            if r.content_type != "application/x-ndjson":
+                # servidor sin streaming o error previo a la ejecución: respuesta JSON normal
+                data = await r.json(content_type=None)
+                for piece in (data.get("result") or {}).get("content", []):
+                    yield {"event": "content", "id": data.get("id"), "content": piece}
+                yield dict(data, event="result" if "result" in data else "error", status=r.status)
+                return
+            buf = b""
+            async for chunk in r.content.iter_any():
+                # se separa a mano: una pieza grande puede superar el límite de línea de aiohttp
+                buf += chunk
+                *lines, buf = buf.split(b"\n")
+                for line in lines:
+                    if line.strip(): yield dict(json.loads(line), status=r.status)
+            if buf.strip(): yield dict(json.loads(buf), status=r.status)
+
+    async def call_many(self, calls: List[Tuple[str, dict]], use_batch: bool = True) -> List[dict]:
+        # Varias llamadas en paralelo. Si el servidor soporta batch JSON-RPC se envía un solo POST;
+        # si no, se reparten sobre el pool con concurrencia acotada. El resultado respeta el orden.
+        if not calls: return []
+        if use_batch and self._batch_ok is not False:
+            payload = [{"id": i, "name": n, "arguments": a} for i, (n, a) in enumerate(calls)]
+            idempotent = all(n not in self.WRITE_TOOLS for n, _ in calls)
+            try:
+                status, data = await self.post("/mcp/tools/call", payload, idempotent)
+            except aiohttp.ClientConnectorError:
+                status, data = None, None   # no llegó al servidor: se reparte en llamadas sueltas
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not idempotent: raise    # pudo aplicarse: no se reenvía
+                status, data = None, None
+            if isinstance(data, list):
+                self._batch_ok = True
+                by_id = {d.get("id"): d for d in data}
+                return [by_id.get(i, {"error": {"message": "sin respuesta"}}) for i in range(len(calls))]
+            if status in self.BATCH_REJECT_STATUS:
+                self._batch_ok = False
+            elif status is not None and status != 413 and not idempotent:
+                # fallo del servidor con escrituras en el lote: no se repiten una a una
+                err = data if isinstance(data, dict) and "error" in data else {"error": {"message": f"HTTP {status}"}}
+                return [err] * len(calls)
+        sem = asyncio.Semaphore(self.concurrency)
+        async def one(n, a):
+            async with sem:
+                return (await self.call(n, a))[1]
+        return list(await asyncio.gather(*(one(n, a) for n, a in calls)))
+
+
+client = MCPClient()
+
 async def http_get(path: str):
-    async with aiohttp.ClientSession() as s:
-        async with s.get(f"{BASE_URL}{path}") as r:
-            return await r.json()
+    return await client.get(path)
 
 async def http_post(path: str, payload: dict):
-    async with aiohttp.ClientSession() as s:
-        async with s.post(f"{BASE_URL}{path}", json=payload) as r:
-            data = await r.json()
-            return r.status, data
+    return await client.post(path, payload)
 
-async def call_tool(name: str, arguments: dict):
-    payload = {"id": f"req-{datetime.now().timestamp()}", "name": name, "arguments": arguments}
-    status, data = await http_post("/mcp/tools/call", payload)
+def show_result(name: str, status, data: dict):
     if "result" in data:
         for item in data["result"]["content"]:
             console.print(Panel(item.get("text","(sin texto)"), title=f"{name} [{status}]"))
     else:
         console.print(Panel(str(data), title=f"Error [{status}]", style="red"))
 
+async def stream_tool(name: str, arguments: dict):
+    # muestra cada pieza al llegar y devuelve (status, respuesta) con el contenido ya reunido
+    console.rule(name)
+    pieces, final, status = [], {}, None
+    async for ev in client.stream(name, arguments):
+        status = ev.pop("status", status)
+        if ev.get("event") == "content":
+            pieces.append(ev["content"])
+            console.print(ev["content"].get("text", ""), markup=False, highlight=False)
+        else:
+            final = ev
+    if "result" in final:
+        final["result"]["content"] = pieces
+        console.rule(f"[{status}]" + (" [red]error[/red]" if final["result"].get("isError") else ""))
+    else:
+        console.print(Panel(str(final.get("error", final)), title=f"Error [{status}]", style="red"))
+    return status, final
+
+async def call_tool(name: str, arguments: dict):
+    if STREAM_OUTPUT:
+        status, data = await stream_tool(name, arguments)
+    else:
+        status, data = await client.call(name, arguments)
+        show_result(name, status, data)
+    job = (data.get("result") or {}).get("structuredContent") or {}
+    if name == "report.generate" and job.get("job_id") and job.get("status") not in ("done", "error"):
+        await wait_report(job["job_id"])
+
+async def wait_report(job_id: str, poll: float = 0.5, timeout: float = 300.0):
+    # los reportes se generan en segundo plano: se consulta report.status hasta que termine
+    deadline = asyncio.get_running_loop().time() + timeout
+    with console.status("Generando reporte...") as spinner:
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(poll)
+            status, data = await client.call("report.status", {"job_id": job_id})
+            job = (data.get("result") or {}).get("structuredContent") or {}
+            spinner.update(f"Generando reporte... {job.get('progress', 0):.0%}")
+            if job.get("status") in ("done", "error") or "result" not in data:
+                break
+    show_result("report.status", status, data)
+
+async def call_tools(calls: List[Tuple[str, dict]]):
+    results = await client.call_many(calls)
+    for (name, _), data in zip(calls, results):
+        show_result(name, "batch", data)
+
+
+async def ingest_docs(path: str):
+    # documentos .txt (un archivo o todos los de una carpeta) en una sola subida multipart
+    p = pathlib.Path(path).expanduser()
+    files = sorted(p.glob("*.txt")) if p.is_dir() else [p] if p.exists() else []
+    if not files:
+        console.print(f"[red]Sin documentos .txt en: {p}[/red]"); return
+    form = aiohttp.FormData()
+    for f in files:
+        form.add_field("files", f.read_bytes(), filename=f.name, content_type="text/plain")
+    status, data = await client.request("POST", "/mcp/ingest/docs", retries=0, data=form)
+    if "result" in data:
+        console.print(Panel(data["result"]["content"][0]["text"], title=f"docs.ingest [{status}]"))
+    else:
+        console.print(Panel(str(data), title=f"Error [{status}]", style="red"))
 
-async def ingest_csv(kind: str, path: str):
+async def ingest_csv(kind: str, path: str, mode: str = "replace"):
+    # subida en streaming (el archivo no se carga completo en memoria ni se codifica en base64);
+    # sin reintentos: el cuerpo ya se consumió
     p = pathlib.Path(path).expanduser()
     if not p.exists():
         console.print(f"[red]Archivo no encontrado: {p}[/red]"); return
-    b64 = base64.b64encode(p.read_bytes()).decode("ascii")
-    await call_tool("admin.ingest_csv", {"kind": kind, "csv_base64": b64})
+    with p.open("rb") as fh:
+        status, data = await client.request("POST", f"/mcp/ingest/{kind}", retries=0, params={"mode": mode},
+                                            data=fh, headers={"Content-Type": "text/csv"})
+    if "result" in data:
+        console.print(Panel(data["result"]["content"][0]["text"], title=f"admin.ingest [{status}]"))
+    else:
+        console.print(Panel(str(data), title=f"Error [{status}]", style="red"))
 
 
 MONTHS_ES = {
@@ -45,88 +256,93 @@ MONTHS_ES = {
     "octubre":"Octubre","noviembre":"Noviembre","diciembre":"Diciembre"
 }
 
-def extract_month(text: str):
-    t = text.lower()
-    for k,v in MONTHS_ES.items():
-        if k in t:
-            return v
-    return None
-
-def extract_top(text: str):
-    # “top 3”, “top3”, “los 5 más”, etc.
-    m = re.search(r"top\s*([0-9]+)", text, re.I) or re.search(r"los\s+([0-9]+)\s+m[aá]s", text, re.I)
-    return int(m.group(1)) if m else None
-
-def prefers_units(text: str):
-    return bool(re.search(r"\b(unidades|u\.?|por unidades)\b", text, re.I))
-
-def prefers_revenue(text: str):
-    return bool(re.search(r"\b(ventas|ingresos|revenue|facturaci[oó]n)\b", text, re.I))
-
-def wants_pdf(text: str):
-    return bool(re.search(r"\bpdf\b", text, re.I))
-
-def wants_csv(text: str):
-    return bool(re.search(r"\bcsv\b", text, re.I))
-
-def is_inventory_query(text: str):
-    return bool(re.search(r"\b(inventario|stock|existencias|almac[eé]n)\b", text, re.I))
-
-def is_sales_query(text: str):
-    return bool(re.search(r"\b(venta|ventas|facturaci[oó]n|ingresos)\b", text, re.I))
-
-def is_report_request(text: str):
-    return bool(re.search(r"\b(reporte|informe|genera|generar|exporta|exportar)\b", text, re.I))
-
-def is_docs_search(text: str):
-    return bool(re.search(r"\b(doc|documento|pol[ií]tica|manual|procedimiento|buscar en doc)\b", text, re.I))
-
-def extract_docs_query(text: str):
-    m = re.search(r"[\"“](.+?)[\"”]", text)
-    if m: return m.group(1)
+# Clasificador de intención en una sola pasada: una regex compilada separa el mensaje en tokens (texto entre
+# comillas, números, palabras) y cada palabra se resuelve con una búsqueda en tabla. Los rasgos con valor
+# (top 3, lead 10, factor seguridad 1.3, los 5 más) toman el número que sigue a su palabra clave.
+INTENT_RE = re.compile(r"[\"“](?P<quote>.+?)[\"”]|(?P<num>\d+(?:\.\d+)?)|(?P<word>[^\W\d_]+)")
+INTENT_WORDS = {
+    **dict.fromkeys(("reporte", "informe", "genera", "generar", "exporta", "exportar"), "report"),
+    **dict.fromkeys(("ventas", "facturación", "facturacion", "ingresos"), "sales_rev"),
+    **dict.fromkeys(("inventario", "stock", "existencias", "almacén", "almacen"), "inventory"),
+    **dict.fromkeys(("unidades", "u"), "units"),
+    **dict.fromkeys(MONTHS_ES, "month"),
+    "venta": "sales", "revenue": "revenue", "pdf": "pdf", "csv": "csv", "resumen": "summary", "top": "top",
+}
+INTENT_PREFIXES = re.compile(r"(?P<reorder>reabast|reorden|repon|sugerencia)|(?P<docs>doc|pol[ií]tica|manual|procedimiento)")
+INTENT_ALIASES = {"sales_rev": ("sales", "revenue")}
+INTENT_NUMBER_AFTER = {"top": ("top", 1), "lead": ("lead", 2), "factor": ("sf", 3)}   # palabra -> (rasgo, tokens de distancia)
+
+def classify(text: str) -> dict:
+    # rasgo -> valor de la primera aparición (True si no lleva valor)
+    feats = {}
+    pending, window, prev = None, 0, ("", "")
+    for m in INTENT_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "quote":
+            feats.setdefault("quote", m.group("quote")); pending = None
+            continue
+        tok = m.group().lower()
+        if kind == "num":
+            if pending and window > 0 and feats.get(pending, True) is True: feats[pending] = tok
+            pending = None
+        else:
+            name = INTENT_WORDS.get(tok)
+            if name is None:
+                pm = INTENT_PREFIXES.match(tok)
+                name = pm.lastgroup if pm else None
+            if name:
+                feats.setdefault(name, tok if name == "month" else True)
+                for alias in INTENT_ALIASES.get(name, ()): feats.setdefault(alias, True)
+            if tok in INTENT_NUMBER_AFTER:
+                pending, window = INTENT_NUMBER_AFTER[tok]
+                window += 1
+            elif tok in ("más", "mas") and prev[0] == "los" and prev[1][:1].isdigit():
+                if feats.get("top", True) is True: feats["top"] = prev[1]
+        window -= 1
+        prev = (prev[1], tok)
+    return feats
+
+def extract_docs_query(text: str, feats: dict):
+    if feats.get("quote"): return feats["quote"]
     m = re.search(r"(sobre|de|acerca de)\s+(.+)$", text, re.I)
     if m: return m.group(2).strip()
     words = [w for w in re.findall(r"\w{5,}", text)]
     return " ".join(words[:6]) if words else None
 
 def route_nl(text: str):
- 
     t = text.strip()
+    f = classify(t)
 
-    if is_report_request(t):
-        fmt = "pdf" if wants_pdf(t) else ("csv" if wants_csv(t) else "pdf")
-        if is_inventory_query(t):
+    if "report" in f:
+        fmt = "csv" if "csv" in f and "pdf" not in f else "pdf"
+        if "inventory" in f:
             return ("report.generate", {"type":"inventario", "format": fmt})
-        if is_sales_query(t):
+        if "sales" in f:
             return ("report.generate", {"type":"ventas", "format": fmt})
         return ("report.generate", {"type":"general", "format": fmt})
 
-    if is_sales_query(t) and re.search(r"\b(top|los\s+\d+\s+m[aá]s)\b", t, re.I):
-        n = extract_top(t) or 5
-        by = "units" if prefers_units(t) and not prefers_revenue(t) else "revenue"
-        return ("sales.top", {"n": n, "by": by})
-
-    if is_sales_query(t) or re.search(r"\bresumen\b", t, re.I):
-        month = extract_month(t)
-        args = {"month": month} if month else {}
-        return ("sales.summary", args)
-
-    if is_inventory_query(t) and re.search(r"\b(reabaste|reorden|reponer|sugerencia)\b", t, re.I):
-        m_lead = re.search(r"lead\s*(?:time)?\s*(\d+)", t, re.I)
-        m_sf   = re.search(r"(safety\s*factor|factor\s*seguridad)\s*([0-9]+(\.[0-9]+)?)", t, re.I)
-        args={}
-        if m_lead: args["lead_time_days"] = int(m_lead.group(1))
-        if m_sf:   args["safety_factor"]  = float(m_sf.group(2))
-        return ("inventory.reorder_suggestions", args or {})
-
-    if is_inventory_query(t):
+    if "sales" in f and "top" in f:
+        n = f["top"] if f["top"] is not True else 5
+        by = "units" if "units" in f and "revenue" not in f else "revenue"
+        return ("sales.top", {"n": int(float(n)), "by": by})   # "top 2.5" -> 2
+
+    if "sales" in f or "summary" in f:
+        return ("sales.summary", {"month": MONTHS_ES[f["month"]]} if "month" in f else {})
+
+    if "inventory" in f and "reorder" in f:
+        args = {}
+        if "lead" in f: args["lead_time_days"] = int(float(f["lead"]))
+        if "sf" in f:   args["safety_factor"]  = float(f["sf"])
+        return ("inventory.reorder_suggestions", args)
+
+    if "inventory" in f:
         return ("inventory.status", {})
 
-    if is_docs_search(t):
-        q = extract_docs_query(t)
+    if "docs" in f:
+        q = extract_docs_query(t, f)
         if q: return ("docs.search", {"q": q})
 
-    return None  
+    return None
 
 HELP = (
 "[bold]MCP Empresa — Modo híbrido[/bold]\n"
@@ -141,9 +357,12 @@ HELP = (
 "• Haz un resumen ejecutivo de ventas e inventario\n\n"
 "[bold]Comandos:[/bold]\n"
 "/tools, /health, /ask \"pregunta\", /sales month=Agosto, /top n=3 by=units,\n"
+"/series start=2024-01 end=2024-06 freq=M|W|D [window=3 metric=units product=Laptop],\n"
 "/inv, /reorder lead_time_days=10 safety_factor=1.3,\n"
 "/report type=ventas format=pdf, /docs q=\"texto\",\n"
-"/ingest kind=sales path=./mis_ventas.csv, /quit\n"
+"/ingest kind=sales path=./mis_ventas.csv [mode=replace|append|upsert], /ingest kind=docs path=./carpeta,\n"
+"/batch [{\"name\":\"sales.top\"},{\"name\":\"inventory.status\"}] (llamadas en paralelo),\n"
+"/stream on|off (mostrar resultados a medida que llegan), /tenant [id] (tienda activa), /quit\n"
 )
 
 def parse_cmd_args(argstr: str) -> dict:
@@ -169,7 +388,75 @@ async def list_tools_ui():
     names = "\n".join(f"• {t['name']}: {t['description']}" for t in data["tools"])
     console.print(Panel(names, title="Herramientas", border_style="cyan"))
 
-async def main():
+async def run_batch(source: str, output: str = "-", concurrency: int = 8) -> int:
+    # Modo no interactivo: una instrucción por línea (archivo o '-' = stdin; '#' comenta). Cada línea se enruta
+    # como en el REPL (o es una llamada JSON {"name","arguments"}) y las llamadas van en paralelo con
+    # concurrencia acotada. Cada resultado se escribe como una línea JSON al terminar (campo 'line' = origen).
+    with (contextlib.nullcontext(sys.stdin) if source == "-" else open(source, encoding="utf-8")) as fh:
+        prompts = [(i, ln.strip()) for i, ln in enumerate(fh, 1) if ln.strip() and not ln.lstrip().startswith("#")]
+    sem = asyncio.Semaphore(max(1, concurrency))
+    failed = 0
+
+    async def one(line_no: int, prompt: str, out) -> None:
+        nonlocal failed
+        t0 = time.perf_counter()
+        try:
+            call = json.loads(prompt) if prompt.startswith("{") else None
+            routed = (call["name"], call.get("arguments", {})) if call else route_nl(prompt)
+        except (ValueError, KeyError, TypeError) as e:
+            # instrucción que no se puede enrutar: se informa en su línea y el resto del lote sigue
+            failed += 1
+            out.write(json.dumps({"line": line_no, "prompt": prompt, "isError": True,
+                                  "error": {"message": f"Instrucción inválida: {e}"}}, ensure_ascii=False) + "\n")
+            out.flush()
+            return
+        name, arguments = routed or ("llm.ask", {"query": prompt})
+        rec = {"line": line_no, "prompt": prompt, "tool": name, "arguments": arguments, "routed": routed is not None,
+               "route_us": round((time.perf_counter() - t0) * 1e6, 1)}
+        async with sem:
+            t1 = time.perf_counter()
+            try:
+                status, data = await client.call(name, arguments)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, data = None, {"error": {"message": f"{type(e).__name__}: {e}"}}
+            rec["ms"] = round((time.perf_counter() - t1) * 1000, 2)
+        rec["status"] = status
+        result = (data or {}).get("result")
+        if result is not None:
+            rec["isError"] = bool(result.get("isError"))
+            rec["text"] = "\n".join(c.get("text", "") for c in result.get("content", []))
+            if "structuredContent" in result: rec["structuredContent"] = result["structuredContent"]
+        else:
+            rec["isError"], rec["error"] = True, (data or {}).get("error", data)
+        failed += rec["isError"]
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+
+    t0 = time.perf_counter()
+    with (contextlib.nullcontext(sys.stdout) if output == "-" else open(output, "w", encoding="utf-8")) as out:
+        await asyncio.gather(*(one(i, p, out) for i, p in prompts))
+    elapsed = time.perf_counter() - t0
+    Console(stderr=True).print(f"{len(prompts)} llamadas en {elapsed:.2f}s "
+                               f"({len(prompts) / elapsed if elapsed else 0:.1f}/s), {failed} con error")
+    return 1 if failed else 0
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Cliente MCP: REPL interactivo o modo batch (--batch)")
+    ap.add_argument("--batch", metavar="ARCHIVO", help="instrucciones, una por línea ('-' = stdin); salida JSONL")
+    ap.add_argument("-o", "--output", default="-", help="archivo JSONL de resultados (por defecto stdout)")
+    ap.add_argument("-c", "--concurrency", type=int, default=client.concurrency, help="llamadas simultáneas en --batch")
+    ap.add_argument("--tenant", help="tenant (X-Tenant); por defecto MCP_TENANT")
+    opts = ap.parse_args(argv)
+    if opts.tenant: client.tenant = opts.tenant
+    try:
+        if opts.batch: return await run_batch(opts.batch, opts.output, opts.concurrency)
+        await repl()
+        return 0
+    finally:
+        await client.close()
+
+async def repl():
+    global STREAM_OUTPUT
     console.print(Panel(HELP, title="Ayuda", border_style="green"))
     while True:
         msg = Prompt.ask("[bold cyan]>[/]").strip()
@@ -188,6 +475,8 @@ async def main():
             args = parse_cmd_args(msg[len("/sales"):]); await call_tool("sales.summary", args); continue
         if msg.startswith("/top"):
             args = parse_cmd_args(msg[len("/top"):]); await call_tool("sales.top", args); continue
+        if msg.startswith("/series"):
+            args = parse_cmd_args(msg[len("/series"):]); await call_tool("sales.timeseries", args); continue
         if msg == "/inv":
             await call_tool("inventory.status", {}); continue
         if msg.startswith("/reorder"):
@@ -198,14 +487,33 @@ async def main():
             args = parse_cmd_args(msg[len("/docs"):])
             if not args.get("q"): console.print("[yellow]Uso: /docs q=\"texto\"[/yellow]"); continue
             await call_tool("docs.search", args); continue
+        if msg.startswith("/batch"):
+            try:
+                items = json.loads(msg[len("/batch"):].strip() or "[]")
+                calls = [(it["name"], it.get("arguments", {})) for it in items]
+            except (ValueError, KeyError, TypeError):
+                console.print("[yellow]Uso: /batch [{\"name\":\"sales.top\",\"arguments\":{\"n\":3}}, ...][/yellow]"); continue
+            await call_tools(calls); continue
+        if msg.startswith("/stream"):
+            opt = msg[len("/stream"):].strip().lower()
+            STREAM_OUTPUT = (opt != "off") if opt in ("on", "off") else not STREAM_OUTPUT
+            console.print(f"Streaming {'activado' if STREAM_OUTPUT else 'desactivado'}"); continue
+        if msg.startswith("/tenant"):
+            client.tenant = msg[len("/tenant"):].strip().lower()
+            console.print(f"Tenant: {client.tenant or '(por defecto)'}"); continue
         if msg.startswith("/ingest"):
             args = parse_cmd_args(msg[len("/ingest"):])
             kind, path = args.get("kind"), args.get("path")
             if not kind or not path:
-                console.print("[yellow]Uso: /ingest kind=sales|inventory path=./archivo.csv[/yellow]"); continue
-            await ingest_csv(kind, path); continue
-
-        routed = route_nl(msg)
+                console.print("[yellow]Uso: /ingest kind=sales|inventory|docs path=./archivo.csv [mode=append][/yellow]"); continue
+            if kind == "docs":
+                await ingest_docs(path); continue
+            await ingest_csv(kind, path, args.get("mode", "replace")); continue
+
+        try:
+            routed = route_nl(msg)
+        except (ValueError, KeyError, TypeError) as e:
+            console.print(f"[red]No se pudo interpretar la instrucción: {e}[/red]"); continue
         if routed:
             name, arguments = routed
             await call_tool(name, arguments)
@@ -214,4 +522,4 @@ async def main():
         await call_tool("llm.ask", {"query": msg})
 
 if __name__=="__main__":
-    asyncio.run(main())
+    sys.exit(asyncio.run(main()))